@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# benchmarks the node status pipeline (parsing and building the fork tree) on synthetic networks, to catch regressions without a cluster.
+#
+# python3 bench_node_status.py --peers 1000 10000 50000 --forks 4 --fork-depth 10
+
+import argparse
+import json
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+import fork_tree
+import node_status
+import peer_table
+import topology
+
+# ========================================================================
+
+def random_id(prefix, length, rng):
+  return prefix + ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+# a main chain of k + fork_depth blocks, with forks branching off fork_depth blocks below its tip, each fork_depth blocks long
+def synthetic_chains(k, forks, fork_depth, rng):
+  main = [ random_id('3N', 50, rng) for _ in range(k + fork_depth) ]
+  chains = [ main ]
+  for _ in range(forks):
+    base = main[:k]
+    chains.append(base + [ random_id('3N', 50, rng) for _ in range(fork_depth) ])
+  return chains
+
+# one node status response line per peer. most peers are on the main chain (some a few blocks behind), the rest are spread over the forks,
+# some are still catching up with short chains and a few respond with errors
+def synthetic_network(peers, k, forks, fork_depth, error_rate=0.02, seed=0):
+  rng = random.Random(seed)
+  chains = synthetic_chains(k, forks, fork_depth, rng)
+  peer_ids = [ random_id('12D3KooW', 44, rng) for _ in range(peers) ]
+  addrs = [ '10.{}.{}.{}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(peers) ]
+
+  lines = []
+  for i, peer_id in enumerate(peer_ids):
+    if rng.random() < error_rate:
+      lines.append(json.dumps({ 'peer_id': peer_id, 'error': { 'string': 'dial to {} failed: context deadline exceeded'.format(peer_id) } }))
+      continue
+
+    chain = chains[0] if rng.random() < 0.7 or forks == 0 else rng.choice(chains[1:])
+    tip = len(chain) - rng.choice([ 0, 0, 0, 1, 2, 3 ])
+    length = k if rng.random() < 0.95 else rng.randrange(1, k)
+    blocks = chain[max(0, tip - length):tip]
+
+    neighbours = [ rng.randrange(peers) for _ in range(rng.randrange(10, 50)) ]
+    lines.append(json.dumps({
+      'node_peer_id': peer_id,
+      'node_ip_addr': addrs[i],
+      'sync_status': 'Synced',
+      'protocol_state_hash': blocks[-1],
+      'k_block_hashes_and_timestamps': [ [ b, '2021-01-01 00:00:00.000000Z' ] for b in blocks ],
+      'peers': [ { 'host': addrs[j], 'libp2p_port': 10909, 'peer_id': peer_ids[j] } for j in neighbours ],
+      'block_producers': [ random_id('B62q', 51, rng) ],
+      'git_commit': 'abcdef0',
+      'uptime_minutes': rng.randrange(10000),
+      'ban_statuses': [],
+    }))
+  return lines
+
+# ========================================================================
+
+# parses the responses into a peer table sharing the tree's block index, like collect_node_status
+def parse(lines, tree):
+  table = peer_table.PeerTable(tree.index)
+  for resp in node_status.decode_node_statuses(iter(lines), peer_table.fields):
+    table.add(resp)
+  return table
+
+def build_tree(table, tree, n=3):
+  for p in table.peers():
+    tree.ingest(p.key(), p.chain)
+  tree.retain_peers(set(table.records))
+  tree.prune()
+  tips = [ p.chain[-1] if len(p.chain) > 0 else -1 for p in table.peers() ]
+  near, _, _ = tree.blocks_behind(tree.index.id(tree.most_common_tip()), tips, n)
+  return tree, near.sum()
+
+def analyze_topology(table):
+  return topology.analyze(*topology.build(table.peer_lists()))
+
+def timed(fn, *args):
+  start = time.time()
+  result = fn(*args)
+  return result, time.time() - start
+
+# peak memory allocated while running fn, in MB. measured separately from the timings since tracemalloc slows everything down
+def peak_memory(fn, *args):
+  tracemalloc.start()
+  try:
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak / (1024*1024)
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark node status parsing and fork tree building on synthetic networks")
+  parser.add_argument("--peers", help="network sizes to benchmark", nargs='+', default=[ 1000, 10000, 50000 ], type=int)
+  parser.add_argument("--forks", help="number of forks off the main chain", required=False, default=2, type=int)
+  parser.add_argument("--fork-depth", help="length of each fork", required=False, default=5, type=int)
+  parser.add_argument("-k", help="number of blocks in each peer's k_block_hashes_and_timestamps", required=False, default=290, type=int)
+  parser.add_argument("--no-memory", help="skip the (slow) peak memory measurements", action='store_true')
+  args = parser.parse_args(sys.argv[1:])
+
+  print('{:>8} {:>10} {:>10} {:>10} {:>12} {:>12} {:>10} {:>12}'.format('peers', 'MB', 'parse s', 'tree s', 'parse MB', 'tree MB', 'near tip', 'topology s'))
+  for peers in args.peers:
+    lines = synthetic_network(peers, args.k, args.forks, args.fork_depth)
+    size = sum(len(l) for l in lines) / (1024*1024)
+
+    tree = fork_tree.ForkTree(k=args.k)
+    table, parse_seconds = timed(parse, lines, tree)
+    (tree, near), tree_seconds = timed(build_tree, table, tree)
+    _, topology_seconds = timed(analyze_topology, table)
+
+    if args.no_memory:
+      parse_mb, tree_mb = float('nan'), float('nan')
+    else:
+      tree = fork_tree.ForkTree(k=args.k)
+      parse_mb = peak_memory(parse, lines, tree)
+      tree_mb = peak_memory(build_tree, parse(lines, tree), tree)
+
+    print('{:>8} {:>10.1f} {:>10.2f} {:>10.2f} {:>12.1f} {:>12.1f} {:>10} {:>12.2f}'.format(peers, size, parse_seconds, tree_seconds, parse_mb, tree_mb, near, topology_seconds))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,86 @@
+import collections
+import time
+
+from google.cloud import storage
+
+# ========================================================================
+
+# daemons upload each block they see as <network>-<height>-<state hash>.json. heights aren't zero padded, so names don't sort by height across
+# different numbers of digits; instead of listing the whole namespace every time, only the blocks in the decade of heights at the high-water mark
+# (prefix <network>-<height // 10>, starting from the high-water mark) and the decades after it are listed. blocks can be uploaded out of order
+# (a daemon catching up, or a fork), so the listing starts lookback_heights below the high-water mark; the ones already seen are told apart by
+# their generation. heights below 10 don't share a decade prefix, a chain that young is listed in full.
+# to run against a local fake gcs server (e.g. fsouza/fake-gcs-server), set STORAGE_EMULATOR_HOST=http://localhost:4443
+class BlockBucketWatcher:
+
+  def __init__(self, bucket, network, client=None, window_seconds=60*60, lookback_heights=10):
+    self.bucket = bucket
+    self.network = network
+    self.client = client
+    self.window_seconds = window_seconds
+    self.lookback_heights = lookback_heights
+    self.max_height = None
+    self.newest_generation = 0
+    # upload times (seconds) of the blocks seen within the window, oldest first
+    self.recent_uploads = collections.deque()
+
+  def _list(self, prefix, start_offset=None):
+    if self.client is None:
+      self.client = storage.Client()
+    if start_offset is None:
+      return self.client.list_blobs(self.bucket, prefix=prefix)
+    return self.client.list_blobs(self.bucket, prefix=prefix, start_offset=start_offset)
+
+  def height(self, blob_name):
+    try:
+      return int(blob_name[len(self.network) + 1:].split('-')[0])
+    except ValueError:
+      return None
+
+  def _new_blobs(self):
+    start_height = None if self.max_height is None else self.max_height - self.lookback_heights
+    if start_height is None or start_height < 10:
+      # nothing to go on yet (or a chain too young for decade prefixes), one full listing (paged by the client rather than loaded all at once)
+      yield from self._list(self.network + '-')
+      return
+
+    decade = start_height // 10
+    last_decade = self.max_height // 10
+    start_offset = '{}-{}'.format(self.network, start_height)
+    while True:
+      blobs = list(self._list('{}-{}'.format(self.network, decade), start_offset))
+      yield from blobs
+      heights = [ self.height(b.name) for b in blobs ]
+      start_offset = None
+      # keep going up to the high-water mark, and past it while the chain has reached this decade
+      if decade > last_decade and not any(h is not None and h // 10 == decade for h in heights):
+        return
+      decade += 1
+
+  def check(self):
+    now = time.time()
+    previous_generation = self.newest_generation
+
+    for b in self._new_blobs():
+      h = self.height(b.name)
+      if h is not None:
+        self.max_height = max(h, self.max_height or h)
+      if b.generation > previous_generation:
+        self.newest_generation = max(self.newest_generation, b.generation)
+        if now - b.generation/1e6 <= self.window_seconds:
+          self.recent_uploads.append(b.generation/1e6)
+
+    self.recent_uploads = collections.deque(sorted(t for t in self.recent_uploads if now - t <= self.window_seconds))
+
+  # seconds since the newest block was uploaded
+  def newest_age(self):
+    return time.time() - self.newest_generation/1e6
+
+  def uploads_per_hour(self):
+    return len(self.recent_uploads) * 3600 / self.window_seconds
+
+  # the longest stretch within the window without an upload, including the time since the last one
+  def max_gap(self):
+    now = time.time()
+    times = [ now - self.window_seconds ] + list(self.recent_uploads) + [ now ]
+    return max(b - a for a, b in zip(times, times[1:]))
@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+
+# ========================================================================
+
+# interns state hashes to dense integer ids and keeps the parent of each block in a numpy array, so chain computations can work on
+# arrays of ids instead of dicts of base58 strings. ids are never reused: forgetting blocks frees their hashes but not their slots,
+# which only grow by the number of distinct blocks seen (a few hundred a day)
+class BlockIndex:
+
+  def __init__(self, capacity=1024):
+    self._lock = threading.Lock()
+    self.ids = {}
+    self.hashes = []
+    # parent id of each block, -1 when unknown
+    self.parent = np.full(capacity, -1, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.hashes)
+
+  def intern(self, state_hash):
+    state_id = self.ids.get(state_hash)
+    if state_id is not None:
+      return state_id
+    with self._lock:
+      state_id = self.ids.get(state_hash)
+      if state_id is None:
+        state_id = len(self.hashes)
+        self.hashes.append(state_hash)
+        self.ids[state_hash] = state_id
+      return state_id
+
+  # a chain of state hashes as an array of ids
+  def intern_chain(self, chain):
+    return np.fromiter((self.intern(h) for h in chain), dtype=np.int64, count=len(chain))
+
+  def hash(self, state_id):
+    return self.hashes[state_id]
+
+  def id(self, state_hash):
+    return self.ids.get(state_hash, -1)
+
+  def _grow(self):
+    if len(self.parent) < len(self.hashes):
+      parent = np.full(max(len(self.hashes), 2*len(self.parent)), -1, dtype=np.int64)
+      parent[:len(self.parent)] = self.parent
+      self.parent = parent
+
+  # records the parent links of a chain of ids (most recent last)
+  def link(self, chain):
+    chain = np.asarray(chain, dtype=np.int64)
+    self._grow()
+    if len(chain) > 1:
+      self.parent[chain[1:]] = chain[:-1]
+
+  # ========================================================================
+
+  # a len(blocks) x (n+1) matrix of each block followed by its first n ancestors, -1 past the oldest known ancestor
+  def ancestors(self, blocks, n):
+    self._grow()
+    matrix = np.full((len(blocks), n + 1), -1, dtype=np.int64)
+    if len(blocks) == 0:
+      return matrix
+    matrix[:, 0] = blocks
+    for depth in range(1, n + 1):
+      previous = matrix[:, depth - 1]
+      known = previous >= 0
+      matrix[known, depth] = self.parent[previous[known]]
+    return matrix
+
+  # (child ids, parent ids) of every known link
+  def links(self):
+    self._grow()
+    children = np.nonzero(self.parent[:len(self.hashes)] >= 0)[0]
+    return children, self.parent[children]
+
+  # forgets every block not in keep, and the parent links leading out of keep
+  def retain(self, keep):
+    self._grow()
+    kept = np.zeros(len(self.parent), dtype=bool)
+    kept[np.asarray(keep, dtype=np.int64)] = True
+    self.parent[~kept] = -1
+    known = self.parent >= 0
+    known[known] = kept[self.parent[known]]
+    self.parent[~known] = -1
+    with self._lock:
+      for state_id in np.nonzero(~kept[:len(self.hashes)])[0]:
+        state_hash = self.hashes[state_id]
+        if state_hash is not None:
+          del self.ids[state_hash]
+          self.hashes[state_id] = None
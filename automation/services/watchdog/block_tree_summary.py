@@ -0,0 +1,129 @@
+import heapq
+import json
+
+# ========================================================================
+
+# summarizes a block tree ({ block: { 'children': set of blocks, 'peers': number of peers with the block } }) by compressing every run of blocks
+# that all the same peers share into its first block, with the number of blocks skipped as 'intermediate_nodes'. iterative, so forks thousands
+# of blocks deep don't hit the recursion limit
+def summarize(fork_tree, roots):
+  summary = {}
+  stack = list(roots)
+  while len(stack) > 0:
+    parent = stack.pop()
+    peers = fork_tree[parent]['peers']
+    children = fork_tree[parent]['children']
+    intermediate_nodes = 0
+    while len(children) == 1:
+      (only_child,) = children
+      if fork_tree[only_child]['peers'] != peers or len(fork_tree[only_child]['children']) == 0:
+        break
+      children = fork_tree[only_child]['children']
+      intermediate_nodes += 1
+    summary[parent] = { 'children': children, 'peers': peers, 'intermediate_nodes': intermediate_nodes }
+    stack.extend(children)
+  return summary
+
+# cuts a summary down to at most max_nodes blocks for display. the blocks with the most peers are kept first, branches with fewer than min_peers
+# peers are left out, and so are all but the max_forks biggest children of a block. what's left out of each block is counted in its
+# 'collapsed_branches' and 'collapsed_peers'
+def apply_budget(summary, max_nodes=100, max_forks=5, min_peers=1):
+  children = set(c for v in summary.values() for c in v['children'])
+  roots = [ b for b in summary if b not in children ]
+
+  kept = {}
+  queue = [ (-summary[r]['peers'], r, None) for r in roots ]
+  heapq.heapify(queue)
+  while len(queue) > 0:
+    negative_peers, block, parent = heapq.heappop(queue)
+    if len(kept) >= max_nodes or -negative_peers < min_peers:
+      if parent is not None:
+        kept[parent]['collapsed_branches'] += 1
+        kept[parent]['collapsed_peers'] += -negative_peers
+      continue
+
+    node = summary[block]
+    by_peers = sorted(node['children'], key=lambda c: summary[c]['peers'], reverse=True)
+    kept[block] = { 'children': set(), 'peers': node['peers'], 'intermediate_nodes': node['intermediate_nodes'], 'collapsed_branches': 0, 'collapsed_peers': 0 }
+    if parent is not None:
+      kept[parent]['children'].add(block)
+    for child in by_peers[max_forks:]:
+      kept[block]['collapsed_branches'] += 1
+      kept[block]['collapsed_peers'] += summary[child]['peers']
+    for child in by_peers[:max_forks]:
+      heapq.heappush(queue, (-summary[child]['peers'], child, block))
+  return kept
+
+# ========================================================================
+
+def block_label(block, node):
+  label = 'block ' + block[-6:] + '\n' + str(node['peers']) + ' nodes'
+  if node.get('collapsed_branches', 0) > 0:
+    label += '\n+' + str(node['collapsed_branches']) + ' smaller branches (' + str(node['collapsed_peers']) + ' nodes)'
+  return label
+
+def render_graphviz(summary, name='block_tree'):
+  from graphviz import Digraph
+
+  g = Digraph(name, format='png')
+  g.attr('node', shape='circle')
+  for block, node in summary.items():
+    g.node(block, label=block_label(block, node))
+  g.attr('node', shape='rectangle', style='filled', color='lightgrey')
+  for block, node in summary.items():
+    children = node['children']
+    intermediate_nodes = node['intermediate_nodes']
+    if len(children) > 0:
+      if intermediate_nodes > 0:
+        g.node(block + '_intermediate', label=str(intermediate_nodes) + ' in common blocks')
+        g.edge(block, block + '_intermediate')
+        for child in children:
+          g.edge(block + '_intermediate', child)
+      else:
+        for child in children:
+          g.edge(block, child)
+  return g.render(view=False)
+
+# lays the summary out in columns by depth (roots on the left) and writes it as a plain svg, without needing graphviz installed
+def render_svg(summary, filename='block_tree.svg', column_width=220, row_height=70):
+  children = set(c for v in summary.values() for c in v['children'])
+  roots = sorted((b for b in summary if b not in children), key=lambda b: -summary[b]['peers'])
+
+  positions = {}
+  rows_used = {}
+  stack = [ (r, 0) for r in reversed(roots) ]
+  while len(stack) > 0:
+    block, depth = stack.pop()
+    row = max(rows_used.get(depth, 0), rows_used.get(depth - 1, 1) - 1)
+    rows_used[depth] = row + 1
+    positions[block] = (20 + depth*column_width, 30 + row*row_height)
+    for child in sorted(summary[block]['children'], key=lambda c: summary[c]['peers']):
+      stack.append((child, depth + 1))
+
+  width = max([ x for x, _ in positions.values() ] + [ 0 ]) + column_width
+  height = max([ y for _, y in positions.values() ] + [ 0 ]) + row_height
+
+  escape = lambda s: s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+  parts = [ '<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="monospace" font-size="11">'.format(width, height) ]
+  for block, node in summary.items():
+    x, y = positions[block]
+    for child in node['children']:
+      cx, cy = positions[child]
+      parts.append('<line x1="{}" y1="{}" x2="{}" y2="{}" stroke="grey"/>'.format(x + 160, y, cx, cy))
+      if node['intermediate_nodes'] > 0:
+        parts.append('<text x="{}" y="{}" fill="grey">{} in common blocks</text>'.format((x + 160 + cx) // 2 - 40, (y + cy) // 2 - 4, node['intermediate_nodes']))
+  for block, node in summary.items():
+    x, y = positions[block]
+    parts.append('<rect x="{}" y="{}" width="160" height="{}" rx="8" fill="white" stroke="black"/>'.format(x, y - 20, 40 if node.get('collapsed_branches', 0) == 0 else 52))
+    for i, line in enumerate(block_label(block, node).split('\n')):
+      parts.append('<text x="{}" y="{}">{}</text>'.format(x + 6, y - 6 + i*13, escape(line)))
+  parts.append('</svg>')
+
+  with open(filename, 'w') as f:
+    f.write('\n'.join(parts))
+  return filename
+
+def render_json(summary, filename='block_tree.json'):
+  with open(filename, 'w') as f:
+    json.dump({ block: dict(node, children=sorted(node['children'])) for block, node in summary.items() }, f, indent=2)
+  return filename
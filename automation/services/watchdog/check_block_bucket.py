@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# checks the BlockBucketWatcher's listing cursor against an in-memory fake of the storage client, without a bucket: an empty bucket, a chain
+# crossing decade prefixes (and a digit), and blocks uploaded out of order. exits non-zero on the first scenario that fails.
+#
+# python3 check_block_bucket.py
+
+import collections
+import sys
+import time
+
+import block_bucket
+
+# ========================================================================
+
+network = 'testnet'
+
+Blob = collections.namedtuple('Blob', [ 'name', 'generation' ])
+
+# list_blobs as the storage client does it: names in lexicographic order, filtered by prefix and start_offset. the generations are upload times
+# in microseconds, like gcs's
+class FakeClient:
+
+  def __init__(self):
+    self.blobs = {}
+    self.listed = 0
+
+  def upload(self, *heights):
+    for height in heights:
+      name = '{}-{}-3N{}.json'.format(network, height, len(self.blobs))
+      # strictly increasing, even for uploads within the same microsecond
+      generation = max([ int(time.time()*1e6) ] + [ b.generation + 1 for b in self.blobs.values() ])
+      self.blobs[name] = Blob(name, generation)
+
+  def list_blobs(self, bucket, prefix=None, start_offset=None):
+    for name in sorted(self.blobs):
+      if (prefix is None or name.startswith(prefix)) and (start_offset is None or name >= start_offset):
+        self.listed += 1
+        yield self.blobs[name]
+
+def watcher(client):
+  return block_bucket.BlockBucketWatcher('fake-bucket', network, client=client)
+
+# checks the watcher after uploading heights: its high-water mark, and how many uploads it has counted so far
+def check(w, client, heights, max_height, uploads):
+  client.upload(*heights)
+  client.listed = 0
+  w.check()
+  if w.max_height != max_height or len(w.recent_uploads) != uploads:
+    raise AssertionError('after uploading {}: max height {}, {} uploads counted (expected {}, {}), {} blobs listed'.format(
+      heights, w.max_height, len(w.recent_uploads), max_height, uploads, client.listed))
+  return client.listed
+
+# ========================================================================
+
+def empty_bucket():
+  client = FakeClient()
+  w = watcher(client)
+  check(w, client, [], None, 0)
+  check(w, client, [], None, 0)
+  assert w.uploads_per_hour() == 0
+  assert w.max_gap() == w.window_seconds
+
+def decade_crossing():
+  client = FakeClient()
+  w = watcher(client)
+  check(w, client, range(1, 8), 7, 7)
+  # past the first decade, while the chain is still too young for decade prefixes
+  check(w, client, range(8, 19), 18, 18)
+  check(w, client, [ 19, 20, 21 ], 21, 21)
+  check(w, client, range(22, 95), 94, 94)
+  # into three digits: the prefix of decade 10 also matches height 10
+  check(w, client, range(95, 103), 102, 102)
+  check(w, client, range(103, 111), 110, 110)
+  # nothing new
+  check(w, client, [], 110, 110)
+  # the listing stays within a few decades of the high-water mark, rather than covering the bucket
+  listed = check(w, client, [ 111 ], 111, 111)
+  assert listed < 30, '{} blobs listed for one new block'.format(listed)
+
+def out_of_order():
+  client = FakeClient()
+  w = watcher(client)
+  check(w, client, range(1, 31), 30, 30)
+  # a block from behind the high-water mark, and another block at an already seen height (a fork)
+  check(w, client, [ 27, 30 ], 30, 32)
+  # a block of the next decade before the rest of this one, then the ones it skipped
+  check(w, client, [ 40 ], 40, 33)
+  check(w, client, range(31, 40), 40, 42)
+
+def main():
+  failed = False
+  for scenario in [ empty_bucket, decade_crossing, out_of_order ]:
+    try:
+      scenario()
+      print('{}: ok'.format(scenario.__name__))
+    except AssertionError as e:
+      print('{}: failed: {}'.format(scenario.__name__, e))
+      failed = True
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
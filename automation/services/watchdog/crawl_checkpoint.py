@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+
+import peer_cache
+
+# ========================================================================
+
+# a journal of a make_report crawl in progress: each valid response as it is merged and each seed once it has been fully queried, one JSON line
+# apiece. the journal is only ever appended to (a line cut short by an interruption is ignored when it is read back), so a crawl that is killed or
+# runs past its deadline can be resumed by the next run: the finished seeds are skipped and only the peers without a response are queried again.
+# the journal is removed once a crawl finishes, and one older than max_age_seconds, or of another namespace, is started over
+class CrawlCheckpoint:
+
+  def __init__(self, path, namespace, max_age_seconds=60*60, flush_seconds=10):
+    self.path = path
+    self.namespace = namespace
+    self.max_age_seconds = max_age_seconds
+    self.flush_seconds = flush_seconds
+    self.started_at = None
+    # peer id -> response
+    self.resps = {}
+    self.seeds_done = set()
+    self._lock = threading.Lock()
+    self._file = None
+    self._last_flush = 0
+
+  def load(self):
+    entries = []
+    # the length of the complete lines, anything after it was cut short
+    valid_bytes = 0
+    if os.path.exists(self.path):
+      with open(self.path, 'rb') as f:
+        for line in f:
+          try:
+            if not line.endswith(b'\n'):
+              break
+            entries.append(json.loads(line))
+          except ValueError:
+            break
+          valid_bytes += len(line)
+
+    header = entries[0] if len(entries) > 0 else {}
+    if 'started_at' not in header or header.get('namespace') != self.namespace or time.time() - header['started_at'] > self.max_age_seconds:
+      self.started_at = time.time()
+      self._file = open(self.path, 'w')
+      self._write({ 'started_at': self.started_at, 'namespace': self.namespace })
+      self.flush()
+      return self
+
+    self.started_at = entries[0]['started_at']
+    for entry in entries[1:]:
+      if 'resp' in entry:
+        self.resps[entry['resp']['node_peer_id']] = entry['resp']
+      elif 'seed_done' in entry:
+        self.seeds_done.add(entry['seed_done'])
+    self._file = open(self.path, 'a')
+    self._file.truncate(valid_bytes)
+    return self
+
+  def resuming(self):
+    return len(self.resps) > 0 or len(self.seeds_done) > 0
+
+  def add(self, resps):
+    with self._lock:
+      for resp in resps:
+        if 'error' in resp or resp['node_peer_id'] in self.resps:
+          continue
+        resp = peer_cache.compact(resp)
+        self.resps[resp['node_peer_id']] = resp
+        self._write({ 'resp': resp })
+      if time.time() - self._last_flush >= self.flush_seconds:
+        self.flush()
+
+  def seed_done(self, seed):
+    with self._lock:
+      self.seeds_done.add(seed)
+      self._write({ 'seed_done': seed })
+      self.flush()
+
+  # splits a seed's current peers (multiaddrs) into the responses already in the checkpoint and the peers still to query
+  def split(self, multiaddrs):
+    with self._lock:
+      done = []
+      remaining = []
+      for multiaddr in multiaddrs:
+        peer_id = peer_cache.multiaddr_peer_id(multiaddr)
+        if peer_id in self.resps:
+          done.append(self.resps[peer_id])
+        else:
+          remaining.append(multiaddr)
+      return done, remaining
+
+  def flush(self):
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    self._last_flush = time.time()
+
+  # complete: the crawl finished, and the next one starts from scratch. otherwise the journal is kept for the next run to resume from
+  def close(self, complete):
+    with self._lock:
+      self.flush()
+      self._file.close()
+      if complete:
+        os.remove(self.path)
+
+  def _write(self, entry):
+    self._file.write(json.dumps(entry) + '\n')
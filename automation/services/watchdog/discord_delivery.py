@@ -0,0 +1,170 @@
+import gzip
+import json
+import queue
+import threading
+import time
+
+import requests
+
+# ========================================================================
+
+# discord's limits for webhook messages. the attachments are kept well under the 8MB limit on a request, which also has to fit the multipart
+# encoding and the payload_json
+message_char_limit = 2000
+files_per_message = 10
+bytes_per_message = int(7.5*1024*1024)
+
+# splits text into pages of at most limit characters, at line breaks where possible
+def pages(text, limit=message_char_limit):
+  result = []
+  page = ''
+  for line in text.split('\n'):
+    while len(line) > limit:
+      if page != '':
+        result.append(page)
+        page = ''
+      result.append(line[:limit])
+      line = line[limit:]
+    candidate = line if page == '' else page + '\n' + line
+    if len(candidate) > limit:
+      result.append(page)
+      page = line
+    else:
+      page = candidate
+  if page != '':
+    result.append(page)
+  return result
+
+# gzips attachments over compress_over_bytes, and splits any that are still too big for one message into parts
+def prepare_files(files, compress_over_bytes):
+  prepared = []
+  for filename, content in files:
+    if isinstance(content, str):
+      content = content.encode('utf-8')
+    if len(content) > compress_over_bytes:
+      content = gzip.compress(content)
+      filename += '.gz'
+    if len(content) <= bytes_per_message:
+      prepared.append((filename, content))
+      continue
+    parts = range(0, len(content), bytes_per_message)
+    for i, start in enumerate(parts):
+      prepared.append(('{}.part{}of{}'.format(filename, i + 1, len(parts)), content[start:start + bytes_per_message]))
+  return prepared
+
+# groups attachments into as few messages as discord allows
+def file_groups(files):
+  groups = []
+  group = []
+  size = 0
+  for filename, content in files:
+    if len(group) == files_per_message or (len(group) > 0 and size + len(content) > bytes_per_message):
+      groups.append(group)
+      group = []
+      size = 0
+    group.append((filename, content))
+    size += len(content)
+  if len(group) > 0:
+    groups.append(group)
+  return groups
+
+# how long a 429 asks to wait. the headers are in seconds, unlike the retry_after in the body, which is in milliseconds on the unversioned (v6)
+# webhook urls
+def rate_limit_seconds(response, default_seconds):
+  for header in [ 'Retry-After', 'X-RateLimit-Reset-After' ]:
+    try:
+      return float(response.headers[header])
+    except (KeyError, ValueError):
+      pass
+  try:
+    retry_after = float(response.json()['retry_after'])
+  except (KeyError, ValueError, TypeError):
+    return default_seconds
+  return retry_after / 1000 if '/api/v' not in response.url or '/api/v6/' in response.url else retry_after
+
+# ========================================================================
+
+# delivers messages to a discord webhook from a background thread, in the order they were sent. long text is split into pages and big
+# attachments are compressed. requests are spaced out to stay under the webhook rate limit (5 requests every 2 seconds), a 429 is retried after
+# the retry_after discord asks for, and other failures are retried with exponential backoff
+class DiscordDelivery:
+
+  def __init__(self, url, requests_per_window=5, window_seconds=2, max_attempts=5, compress_over_bytes=256*1024, timeout_seconds=60):
+    self.url = url
+    self.min_interval_seconds = window_seconds / requests_per_window
+    self.max_attempts = max_attempts
+    self.compress_over_bytes = compress_over_bytes
+    self.timeout_seconds = timeout_seconds
+    self.failed = 0
+    self._queue = queue.Queue()
+    self._last_request = 0
+    self._thread = threading.Thread(target=self._deliver_forever, name='discord-delivery', daemon=True)
+
+  def start(self):
+    self._thread.start()
+    return self
+
+  # queues content (split into pages) and files [(filename, str or bytes)], the files going with the last page. the splitting and compression
+  # happen on the delivery thread too
+  def send(self, content=None, files=[]):
+    self._queue.put((content, files))
+
+  # waits for everything sent so far to be delivered (or given up on), returns whether it all went through
+  def close(self, timeout_seconds=None):
+    self._queue.put(None)
+    self._thread.join(timeout_seconds)
+    return self.failed == 0 and not self._thread.is_alive()
+
+  def _messages(self, content, files):
+    messages = [ (page, []) for page in pages(content or '') ]
+    groups = file_groups(prepare_files(files, self.compress_over_bytes))
+    if len(messages) > 0 and len(groups) > 0:
+      messages[-1] = (messages[-1][0], groups.pop(0))
+    return messages + [ (None, group) for group in groups ]
+
+  def _deliver_forever(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        return
+      for content, files in self._messages(*item):
+        if not self._post(content, files):
+          self.failed += 1
+
+  def _post(self, content, files):
+    payload = { 'content': content } if content is not None else {}
+    backoff_seconds = 1
+    for attempt in range(self.max_attempts):
+      wait = self._last_request + self.min_interval_seconds - time.time()
+      if wait > 0:
+        time.sleep(wait)
+      self._last_request = time.time()
+
+      try:
+        if len(files) > 0:
+          multipart = { 'files[{}]'.format(i): (filename, data) for i, (filename, data) in enumerate(files) }
+          multipart['payload_json'] = (None, json.dumps(payload))
+          response = requests.post(self.url, files=multipart, timeout=self.timeout_seconds)
+        else:
+          response = requests.post(self.url, json=payload, timeout=self.timeout_seconds)
+      except requests.RequestException as e:
+        print('discord delivery failed (attempt {} of {}): {}'.format(attempt + 1, self.max_attempts, e))
+        time.sleep(backoff_seconds)
+        backoff_seconds *= 2
+        continue
+
+      if response.status_code in [ 200, 204 ]:
+        return True
+      if response.status_code == 429:
+        retry_after = rate_limit_seconds(response, backoff_seconds)
+        print('discord rate limited, retrying in {} seconds'.format(retry_after))
+        time.sleep(retry_after)
+        continue
+      if response.status_code < 500:
+        # the message itself is bad, sending it again won't help
+        print('discord rejected message ({}): {}'.format(response.status_code, response.text[:500]))
+        return False
+      print('discord delivery failed (attempt {} of {}): {} {}'.format(attempt + 1, self.max_attempts, response.status_code, response.text[:500]))
+      time.sleep(backoff_seconds)
+      backoff_seconds *= 2
+    return False
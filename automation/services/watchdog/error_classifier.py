@@ -0,0 +1,80 @@
+import collections
+import re
+
+# ========================================================================
+
+# node status error categories, in order of precedence when an error matches more than one. examples:
+# context_deadline_exceeded: 'RPC #369385 failed: "context deadline exceeded"'
+# failed_security_protocol_negotiation: 'RPC #369384 failed: "failed to dial 12D3KooWEsc3KyWrxmDt8J8cBXBwztRrLcYrPKdJXWU4YLdC8z5z: all dials failed\\n  * [/ip4/185.25.49.250/tcp/8302] failed to negotiate security protocol: peer id mismatch: expected 12D3KooWEsc3KyWrxmDt8J8cBXBwztRrLcYrPKdJXWU4YLdC8z5z, but remote key matches 12D3KooWBLcxkHd3KQGeLiNgwVQ8ViEb5EYg3cmSjQs5tDDXQfQb"'
+# connection_refused: 'RPC #369418 failed: "failed to dial 12D3KooWKWzRb7BN7J3zXF6PkRn3sJMRBxvq58ujoTHSUHcNmWdc: all dials failed\\n  * [/ip4/178.170.47.23/tcp/35592] dial tcp4 178.170.47.23:35592: connect: connection refused"'
+categories = [
+  ( 'context_deadline_exceeded', 'context deadline exceeded' ),
+  ( 'failed_security_protocol_negotiation', 'failed to negotiate security protocol' ),
+  ( 'connection_refused', 'connection refused' ),
+  ( 'timed_out', 'timed out requesting node status data from peer' ),
+  ( 'size_limit_exceeded', 'node status data was greater than' ),
+  ( 'stream_reset', 'stream reset' ),
+]
+
+# the coarser libp2p level categories used by the report, also in order of precedence
+libp2p_categories = [
+  ( 'handshake', 'handshake error' ),
+  ( 'heartbeats', 'heartbeats' ),
+  ( 'transport_stopped', 'transport stopped' ),
+  ( 'libp2p', 'libp2p' ),
+]
+
+precedence = { name: i for i, (name, _) in enumerate(categories + libp2p_categories) }
+
+# every pattern in one regex, so each error string is scanned once
+matcher = re.compile('|'.join(
+  [ '(?P<{}>{})'.format(name, re.escape(s)) for name, s in categories + libp2p_categories ] +
+  [ r'(?P<peer_id>12D3KooW[1-9A-HJ-NP-Za-km-z]+)', r'/ip4/(?P<ip>\d+\.\d+\.\d+\.\d+)/tcp/(?P<port>\d+)' ]))
+
+ErrorClass = collections.namedtuple('ErrorClass', [ 'category', 'libp2p_category', 'peer_ids', 'addresses', 'subnet' ])
+
+def classify_string(error_str):
+  found = set()
+  peer_ids = []
+  addresses = []
+  for m in matcher.finditer(error_str):
+    kind = m.lastgroup
+    if kind == 'port':
+      addresses.append((m.group('ip'), int(m.group('port'))))
+    elif kind == 'peer_id':
+      if m.group(kind) not in peer_ids:
+        peer_ids.append(m.group(kind))
+    else:
+      found.add(kind)
+
+  first = lambda names: min([ n for n, _ in names if n in found ], key=lambda n: precedence[n], default='other')
+
+  # the /16 of the first address we couldn't reach, to slice errors by where peers are
+  if len(addresses) > 0:
+    subnet = '.'.join(addresses[0][0].split('.')[:2]) + '.0.0/16'
+  else:
+    subnet = 'unknown'
+
+  return ErrorClass(first(categories), first(libp2p_categories), peer_ids, addresses, subnet)
+
+# classifies an error node status response, e.g. {'error': {'commit_id': ..., 'string': ...}}
+def classify(resp):
+  try:
+    error_str = resp['error']['string']
+  except (KeyError, TypeError):
+    return classify_string(str(resp.get('error', resp)))._replace(category='other')
+  return classify_string(error_str)
+
+# classifies each error response, counting it in error_counter (labeled by category and subnet) if given. returns the number of errors in each category
+def count_errors(error_resps, error_counter=None):
+  counts = collections.Counter()
+  libp2p_counts = collections.Counter()
+  for resp in error_resps:
+    error = classify(resp)
+    counts[error.category] += 1
+    libp2p_counts[error.libp2p_category] += 1
+    if error.category in [ 'size_limit_exceeded', 'other' ]:
+      print("Errored response: {}".format(resp.get('error', resp)))
+    if error_counter is not None:
+      error_counter.labels(category=error.category, subnet=error.subnet).inc()
+  return counts, libp2p_counts
@@ -0,0 +1,98 @@
+import collections
+
+import numpy as np
+
+import block_index
+
+# ========================================================================
+
+# the block tree formed by every peer's k_block_hashes_and_timestamps, kept between collector runs.
+# blocks are ids in a BlockIndex (which the peer table interns into directly), so ingesting a chain is an array assignment of its parent links,
+# and blocks more than k below every peer's tip (i.e. finalized) are pruned
+class ForkTree:
+
+  def __init__(self, k=290):
+    self.k = k
+    self.index = block_index.BlockIndex()
+    # peer -> (tip id, whether the peer reported a full chain of k blocks)
+    self.peer_tips = {}
+    self.tip_peers = {}
+    # only counts peers with a full chain, to leave out nodes that are newly joining or restarting without a persisted frontier
+    self.full_chain_tips = collections.Counter()
+
+  # chain is a sequence of block ids from self.index, most recent last
+  def ingest(self, peer, chain):
+    self.index.link(chain)
+    if len(chain) > 0:
+      self._set_tip(peer, int(chain[-1]), len(chain) >= self.k)
+    else:
+      self._set_tip(peer, None, False)
+
+  def _set_tip(self, peer, tip, full_chain):
+    if peer in self.peer_tips:
+      old_tip, old_full_chain = self.peer_tips.pop(peer)
+      self.tip_peers[old_tip].discard(peer)
+      if len(self.tip_peers[old_tip]) == 0:
+        del self.tip_peers[old_tip]
+      if old_full_chain:
+        self.full_chain_tips[old_tip] -= 1
+        if self.full_chain_tips[old_tip] == 0:
+          del self.full_chain_tips[old_tip]
+
+    if tip is None:
+      return
+
+    self.peer_tips[peer] = (tip, full_chain)
+    self.tip_peers.setdefault(tip, set()).add(peer)
+    if full_chain:
+      self.full_chain_tips[tip] += 1
+
+  # forgets the tips of peers that didn't respond this time around
+  def retain_peers(self, peers):
+    for peer in [ p for p in self.peer_tips if p not in peers ]:
+      self._set_tip(peer, None, False)
+
+  # drops every block that is more than k blocks below all the current tips
+  def prune(self):
+    tips = np.fromiter(self.tip_peers.keys(), dtype=np.int64, count=len(self.tip_peers))
+    near_tips = self.index.ancestors(tips, self.k)
+    self.index.retain(near_tips[near_tips >= 0])
+
+  # ========================================================================
+
+  # state hash -> number of peers with a full chain at that tip
+  def tip_counts(self):
+    return { self.index.hash(tip): count for tip, count in self.full_chain_tips.items() }
+
+  def most_common_tip(self):
+    tip, _ = max(self.full_chain_tips.items(), key=lambda x: x[1])
+    return self.index.hash(tip)
+
+  # the block's state hash followed by up to n of its ancestors', most recent first. a block the index doesn't know is returned on its own,
+  # like a block with no known parent
+  def ancestors(self, block, n):
+    block_id = self.index.id(block)
+    if block_id < 0:
+      return [ block ]
+    blocks = self.index.ancestors([ block_id ], n)[0]
+    return [ self.index.hash(b) for b in blocks if b >= 0 ]
+
+  # where each of the given tips (block ids, -1 for none) is relative to the last n blocks of the chain ending at best (a block id).
+  # a tips x (n+1) matrix of each tip's ancestors is matched against best's ancestors in one go, returning for each tip
+  #  - near: whether any of the tip's last n blocks is among best and its n ancestors
+  #  - behind: how many blocks the tip is behind best (negative when ahead, e.g. on a fork best hasn't seen), where the tip's chain meets best's
+  #  - found: whether the tip's chain meets best's within n blocks at all, behind is meaningless otherwise
+  def blocks_behind(self, best, tips, n):
+    best_chain = self.index.ancestors([ best ], n)[0]
+    best_chain = best_chain[best_chain >= 0]
+    tip_chains = self.index.ancestors(np.asarray(tips, dtype=np.int64), n)
+
+    # matches[p, j, i]: the tip's jth ancestor is best's ith ancestor
+    matches = (tip_chains[:, :, None] == best_chain[None, None, :]) & (tip_chains[:, :, None] >= 0)
+    near = matches[:, :n, :].any(axis=(1, 2))
+
+    at_depth = matches.any(axis=2)
+    found = at_depth.any(axis=1)
+    tip_depth = at_depth.argmax(axis=1)
+    best_depth = matches[np.arange(len(tip_chains)), tip_depth].argmax(axis=1)
+    return near, best_depth - tip_depth, found
@@ -0,0 +1,78 @@
+import ast
+import json
+import os
+import sqlite3
+import time
+
+# ========================================================================
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (ts REAL PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS peer_sightings (hour INTEGER, ip TEXT, peer_id TEXT, ts REAL, PRIMARY KEY (hour, ip, peer_id));
+CREATE TABLE IF NOT EXISTS discord_sightings (hour INTEGER, discord TEXT, ts REAL, PRIMARY KEY (hour, discord));
+CREATE INDEX IF NOT EXISTS peer_sightings_ts ON peer_sightings (ts);
+CREATE INDEX IF NOT EXISTS discord_sightings_ts ON discord_sightings (ts);
+'''
+
+# the responding peers (and discord users) of past make_report runs, in sqlite. sightings are compacted to one row per peer per hour, holding
+# the last time it was seen in that hour, so "seen within the window" stays exact while the store grows with the number of peers rather than runs.
+# rows older than the retention are deleted on every run
+class HistoryStore:
+
+  def __init__(self, path='report_history.sqlite', retention_seconds=8*24*60*60):
+    self.retention_seconds = retention_seconds
+    self.db = sqlite3.connect(path)
+    self.db.executescript(schema)
+
+  def close(self):
+    self.db.close()
+
+  # peers is a list of (ip, peer id), discords a list of discord names
+  def record(self, ts, peers, discords):
+    hour = int(ts // 3600)
+    with self.db:
+      self.db.execute('INSERT OR IGNORE INTO runs VALUES (?)', (ts,))
+      # an insert followed by an update rather than an upsert (ON CONFLICT ... DO UPDATE), which needs sqlite 3.24 and the image has 3.16
+      peers = set(map(tuple, peers))
+      discords = set(discords)
+      self.db.executemany('INSERT OR IGNORE INTO peer_sightings VALUES (?, ?, ?, ?)', [ (hour, ip, peer_id, ts) for ip, peer_id in peers ])
+      self.db.executemany('UPDATE peer_sightings SET ts = max(ts, ?) WHERE hour = ? AND ip = ? AND peer_id = ?', [ (ts, hour, ip, peer_id) for ip, peer_id in peers ])
+      self.db.executemany('INSERT OR IGNORE INTO discord_sightings VALUES (?, ?, ?)', [ (hour, d, ts) for d in discords ])
+      self.db.executemany('UPDATE discord_sightings SET ts = max(ts, ?) WHERE hour = ? AND discord = ?', [ (ts, hour, d) for d in discords ])
+
+  def apply_retention(self, now=None):
+    cutoff = (now or time.time()) - self.retention_seconds
+    with self.db:
+      for table in [ 'runs', 'peer_sightings', 'discord_sightings' ]:
+        self.db.execute('DELETE FROM {} WHERE ts < ?'.format(table), (cutoff,))
+
+  def oldest_run(self):
+    return self.db.execute('SELECT MIN(ts) FROM runs').fetchone()[0]
+
+  # window in hours -> number of distinct peers (ip, peer id), ips and discords seen within it
+  def unique_in_windows(self, windows_in_hours, now=None):
+    now = now or time.time()
+    queries = {
+      'peers': 'SELECT COUNT(*) FROM (SELECT DISTINCT ip, peer_id FROM peer_sightings WHERE ts >= ?)',
+      'ips': 'SELECT COUNT(DISTINCT ip) FROM peer_sightings WHERE ts >= ?',
+      'discords': 'SELECT COUNT(DISTINCT discord) FROM discord_sightings WHERE ts >= ?',
+    }
+    return { kind: { w: self.db.execute(query, (now - w*3600,)).fetchone()[0] for w in windows_in_hours } for kind, query in queries.items() }
+
+  # imports the peer_table.<timestamp>.txt files earlier versions of make_report wrote, renaming each one once it is imported
+  def import_peer_table_files(self, directory='.'):
+    for fname in sorted(os.listdir(directory)):
+      if not fname.startswith('peer_table.') or not fname.endswith('.txt'):
+        continue
+      path = os.path.join(directory, fname)
+      with open(path, 'r') as f:
+        contents = f.read()
+      try:
+        peers = json.loads(contents)
+      except ValueError:
+        peers = ast.literal_eval(contents)
+      ts = float('.'.join(fname.split('.')[1:-1]))
+      discords = [ d for v in peers.values() for d in v.get('discord(s)', []) if d != '' ]
+      self.record(ts, [ tuple(ast.literal_eval(k)) for k in peers.keys() ], discords)
+      os.rename(path, path + '.imported')
+      print('imported', fname, 'into the report history')
@@ -0,0 +1,153 @@
+import collections
+import contextlib
+import http.server
+import os
+import sys
+import threading
+import time
+
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+# ========================================================================
+
+phase_seconds = Histogram('Coda_watchdog_phase_seconds', 'Time spent in each phase (list_pods, exec, transfer, parse, compute) of a collector run', ['namespace', 'collector', 'phase'], buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600))
+exec_bytes = Histogram('Coda_watchdog_exec_bytes', 'Compressed bytes transferred by each command run on a pod', ['namespace', 'collector'], buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9))
+parse_throughput = Gauge('Coda_watchdog_parse_lines_per_second', 'Node status lines parsed per second by the last parse', ['namespace', 'collector'])
+
+# the phases are only printed as well when INSTRUMENTATION_DEBUG is set, the metrics are the record of them
+debug = os.environ.get('INSTRUMENTATION_DEBUG') is not None
+
+# ========================================================================
+
+# which collector (and for which namespace) the current thread is working for, so the phases and profiles can be attributed to it
+_current = threading.local()
+_thread_collectors = {}
+
+def current_collector():
+  return getattr(_current, 'name', None) or 'none'
+
+def current_namespace():
+  return getattr(_current, 'namespace', '')
+
+@contextlib.contextmanager
+def in_collector(name, namespace=''):
+  ident = threading.get_ident()
+  previous = _thread_collectors.get(ident)
+  _current.namespace, _current.name = namespace, name
+  _thread_collectors[ident] = (namespace, name)
+  try:
+    yield
+  finally:
+    if previous is None:
+      _current.namespace, _current.name = '', None
+      _thread_collectors.pop(ident, None)
+    else:
+      _current.namespace, _current.name = previous
+      _thread_collectors[ident] = previous
+
+# for work a collector hands off to other threads, e.g. through a thread pool
+def wrap(fn):
+  name, namespace = current_collector(), current_namespace()
+  def run(*args, **kwargs):
+    with in_collector(name, namespace):
+      return fn(*args, **kwargs)
+  return run
+
+@contextlib.contextmanager
+def span(phase):
+  start = time.time()
+  try:
+    yield
+  finally:
+    observe(phase, time.time() - start)
+
+def observe(phase, seconds):
+  collector = current_collector()
+  if debug:
+    print("{} {} took {} seconds".format(collector, phase, seconds))
+  phase_seconds.labels(namespace=current_namespace(), collector=collector, phase=phase).observe(seconds)
+
+def observe_exec_bytes(received):
+  exec_bytes.labels(namespace=current_namespace(), collector=current_collector()).observe(received)
+
+def observe_parse(lines, seconds):
+  observe('parse', seconds)
+  if seconds > 0:
+    parse_throughput.labels(namespace=current_namespace(), collector=current_collector()).set(lines / seconds)
+
+# ========================================================================
+
+# the profiles are only taken when PROFILE_PORT is set, see serve_profiles
+profiling = os.environ.get('PROFILE_PORT') is not None
+
+# <namespace>/<collector> -> (time the run finished, seconds it took, collapsed stacks)
+profiles = {}
+
+# periodically samples the stacks of every thread working for a collector. the result is in the collapsed stack format
+# ("outermost;...;innermost count" per line) that flamegraph.pl and speedscope read
+class Sampler(threading.Thread):
+
+  def __init__(self, collector, namespace='', interval_seconds=0.01):
+    super().__init__(name='sampler-' + collector, daemon=True)
+    self.collector = (namespace, collector)
+    self.interval_seconds = interval_seconds
+    self.counts = collections.Counter()
+    self.stopped = threading.Event()
+
+  def run(self):
+    while not self.stopped.wait(self.interval_seconds):
+      for ident, frame in sys._current_frames().items():
+        if _thread_collectors.get(ident) != self.collector:
+          continue
+        stack = []
+        while frame is not None:
+          code = frame.f_code
+          stack.append('{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+          frame = frame.f_back
+        self.counts[';'.join(reversed(stack))] += 1
+
+  def collapsed(self):
+    return '\n'.join('{} {}'.format(stack, count) for stack, count in self.counts.most_common())
+
+def qualified_name(name, namespace):
+  return namespace + '/' + name if namespace != '' else name
+
+# runs a collector on the current thread, attributing its work to it and profiling it if enabled
+def run_collector(name, fn, namespace=''):
+  with in_collector(name, namespace):
+    if not profiling:
+      return fn()
+
+    sampler = Sampler(name, namespace)
+    start = time.time()
+    sampler.start()
+    try:
+      return fn()
+    finally:
+      sampler.stopped.set()
+      sampler.join()
+      profiles[qualified_name(name, namespace)] = (time.time(), time.time() - start, sampler.collapsed())
+
+class ProfileHandler(http.server.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    name = self.path.strip('/')
+    if name == '':
+      body = '\n'.join('{} finished at {}, took {} seconds'.format(n, time.ctime(finished), took) for n, (finished, took, _) in sorted(profiles.items()))
+    elif name in profiles:
+      body = profiles[name][2]
+    else:
+      self.send_error(404, 'no profile for ' + name)
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain')
+    self.end_headers()
+    self.wfile.write(body.encode('utf-8'))
+
+# GET / lists the profiled collectors, GET /<namespace>/<collector> (or /<collector> when running without namespaces) returns the profile of its last run
+def serve_profiles():
+  if not profiling:
+    return
+  server = http.server.ThreadingHTTPServer(('', int(os.environ['PROFILE_PORT'])), ProfileHandler)
+  threading.Thread(target=server.serve_forever, name='profile-server', daemon=True).start()
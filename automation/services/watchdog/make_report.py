@@ -12,24 +12,29 @@ import time
 import random
 import itertools
 import numpy as np
-import math
 import ast
 import json
 import csv
+import threading
+import concurrent.futures
 import util
-from os import listdir
-from os.path import isfile, join
-from graphviz import Digraph
+import pod_inventory
+import node_status
+import block_index
+import peer_cache
+import crawl_checkpoint
+import history_store
+import block_tree_summary
+import topology
+import discord_delivery
+import error_classifier
 from datetime import datetime
-import uuid
 from collections import Counter
 
-from kubernetes import client, config, stream
-from discord_webhook import DiscordWebhook
+from kubernetes import client, config
 
 namespace = ''
 discord_webhook_url = None
-discord_char_limit = 2000
 
 def peer_to_multiaddr(peer):
   return '/ip4/{}/tcp/{}/p2p/{}'.format(
@@ -48,6 +53,18 @@ def main():
     parser.add_argument("-a", "--accounts", help="community accounts csv", required=False, type=str, dest="accounts_csv")
     parser.add_argument("-l", "--local", help="run with a local node", required=False, type=bool, default=False)
     parser.add_argument("-b", "--bin", help="local mina binary", required=False, type=str, default="mina", dest="binary")
+    parser.add_argument("--incremental", help="only query the peers that are new or whose cached response is stale, reusing the rest from the peer cache", action='store_true')
+    parser.add_argument("--peer-cache", help="file the last response of each peer is cached in between runs", required=False, type=str, default="peer_cache.json", dest="peer_cache")
+    parser.add_argument("--checkpoint", help="file the crawl is journaled to as it goes, so an interrupted or timed out crawl is resumed by the next run", required=False, type=str, default="crawl_checkpoint.jsonl", dest="checkpoint")
+    parser.add_argument("--checkpoint-max-age-minutes", help="how old an unfinished crawl can be and still be resumed, rather than started over", required=False, type=int, default=60, dest="checkpoint_max_age_minutes")
+    parser.add_argument("--history-db", help="sqlite file the responding peers of each run are kept in", required=False, type=str, default="report_history.sqlite", dest="history_db")
+    parser.add_argument("--seed-concurrency", help="number of seeds queried at once", required=False, type=int, default=4, dest="seed_concurrency")
+    parser.add_argument("--seed-deadline-seconds", help="how long to wait for the seeds before reporting with whatever responses arrived", required=False, type=int, default=600, dest="seed_deadline_seconds")
+    parser.add_argument("--tree-format", help="how to render the block tree: png (with graphviz), or svg / json which don't need graphviz", required=False, choices=[ 'png', 'svg', 'json' ], default='png', dest="tree_format")
+    parser.add_argument("--tree-max-nodes", help="most blocks drawn in the block tree", required=False, type=int, default=100, dest="tree_max_nodes")
+    parser.add_argument("--tree-max-forks", help="most children drawn for each block in the block tree, the smaller ones are collapsed", required=False, type=int, default=5, dest="tree_max_forks")
+    parser.add_argument("--tree-min-peers", help="branches of the block tree with fewer peers than this are collapsed", required=False, type=int, default=1, dest="tree_min_peers")
+    parser.add_argument("--max-age-minutes", help="how old a cached response can be before the peer is queried again in an incremental crawl", required=False, type=int, default=60, dest="max_age_minutes")
 
     # ==========================================
 
@@ -75,19 +92,13 @@ def main():
     # ==========================================
     # Crawl network
 
-    pods = v1.list_namespaced_pod(args.namespace, watch=False)
+    # a one-off snapshot, the report doesn't live long enough to need a watch
+    inventory = pod_inventory.PodInventory(v1, args.namespace).relist()
 
-    pod_names = [ p['metadata']['name'] for p in pods.to_dict()['items'] if p['status']['phase'] == 'Running' ]
-
-    seeds = [ p for p in pod_names if 'seed' in p ]
+    seeds = inventory.pod_names(role='seed', running=True)
 
     seed = seeds[-1]
 
-    seed_pod = [ p for p in pods.to_dict()['items'] if p['metadata']['name'] == seed ][0]
-    seed_daemon_container = [ c for c in seed_pod['spec']['containers'] if c['args'][0] == 'daemon' ][0]
-    seed_vars_dict = [ v for v in seed_daemon_container['env'] ]
-    seed_daemon_port = [ v['value'] for v in seed_vars_dict if v['name'] == 'DAEMON_CLIENT_PORT'][0]
-
     print('seed', seed)
 
     request_timeout_seconds = 600
@@ -109,46 +120,7 @@ def main():
       #pass
 
     def exec_on_seed(command):
-
-      def exec_cmd(command, timeout):
-        exec_command = [
-          '/bin/bash',
-          '-c',
-          command,
-        ]
-        result = stream.stream(v1.connect_get_namespaced_pod_exec, seed, args.namespace, command=exec_command, container='coda', stderr=True, stdout=True, stdin=False, tty=False, _request_timeout=timeout)
-        return result
-
-      print('running command:', command)
-
-      tmp_file = '/tmp/cns_command.' + str(uuid.uuid4()) + '.out'
-
-      start = time.time()
-      result = exec_cmd(command + ' &> ' + tmp_file, request_timeout_seconds)
-      end = time.time()
-
-      print('done running command')
-      print('\tseconds to run:', end - start)
-
-      file_len = int(exec_cmd('stat --printf="%s" ' + tmp_file, 10))
-      print('\tfile length:', str(file_len/(1024*1024)) + 'MB')
-
-
-      read_segment = lambda start, size: exec_cmd('cat ' + tmp_file + ' | head -c ' + str(start + size) + ' | tail -c ' + str(size), 240)
-      chunk_size = int(20e6)
-      read_chunk = lambda i: read_segment(i*chunk_size, min((i+1)*chunk_size, file_len) - i*chunk_size)
-      num_chunks = math.ceil(file_len/chunk_size)
-
-      start = time.time()
-      chunks = list(map(read_chunk, range(num_chunks)))
-      result = ''.join(chunks)
-      end = time.time()
-
-      print('\tseconds to get result:', end - start)
-
-      exec_cmd('rm ' + tmp_file, 10)
-
-      return result
+      return util.exec_on_pod(v1, args.namespace, seed, 'coda', command, request_timeout_seconds)
 
     if args.local:
       exec_command = exec_locally
@@ -159,11 +131,7 @@ def main():
 
     queried_peers = set()
 
-    node_status_heartbeat_errors = []
-    node_status_transport_stopped_errors = []
-    node_status_handshake_errors = []
-    node_status_libp2p_errors = []
-    node_status_other_errors = []
+    libp2p_error_counts = Counter()
 
     uptime_less_than_10_min = []
     uptime_less_than_30_min = []
@@ -183,59 +151,56 @@ def main():
     def no_error(resp):
       return (not (contains_error(resp)))
 
-    def add_resp(resp):
-      # we use ast instead of json to handle properties with single quotes instead of double quotes (which the response seems to often contain)
-      resps = [ ast.literal_eval(s) for s in resp.split('\n') if s != '' ]
-
+    # every run refreshes the cache, so an incremental run can follow a full one
+    cache = peer_cache.PeerCache(args.peer_cache, max_age_seconds=args.max_age_minutes*60).load()
+
+    checkpoint = crawl_checkpoint.CrawlCheckpoint(args.checkpoint, namespace, max_age_seconds=args.checkpoint_max_age_minutes*60).load()
+    resuming = checkpoint.resuming()
+    # responses from the crawl being resumed, up to checkpoint_max_age_minutes old
+    resumed_responses = len(checkpoint.resps)
+
+    # seeds are queried concurrently, their responses are merged here one batch at a time as they are parsed
+    merge_lock = threading.Lock()
+    crawl_finished = threading.Event()
+
+    def merge(resps, fetched=True):
+      with merge_lock:
+        # responses from seeds still going after their deadline are left out, the report has already moved on
+        if crawl_finished.is_set():
+          return
+        if fetched:
+          cache.update(resps)
+          checkpoint.add(resps)
+        add_resps(resps)
+
+    def add_resp(lines):
+      batch = []
+      for resp in node_status.decode_node_statuses(lines):
+        batch.append(resp)
+        if len(batch) >= node_status.batch_size:
+          merge(batch)
+          batch = []
+      merge(batch)
+
+    def add_resps(resps):
       print ('Received %s node_status responses'%(str(len(resps))))
 
       peers = list(filter(no_error,resps))
       error_resps = list(filter(contains_error,resps))
 
-      err_context_deadline = 0
-      err_negotiate_security_protocol = 0
-      err_connection_refused = 0
-      err_time_out = 0
-      err_stream_reset = 0
-      err_size_limit_exceeded = 0
-      err_others = 0
-
-      for p in error_resps:
-        try:
-          error_str = p['error']['string']
-          if 'context deadline exceeded' in error_str:
-            #{'error': {'commit_id': 'baffb589965aa0a8552dca15e209d2a011af3d21', 'string': 'RPC #369385 failed: "context deadline exceeded"'}}
-            err_context_deadline += 1
-          elif 'failed to negotiate security protocol' in error_str:
-            #{'error': {'commit_id': 'baffb589965aa0a8552dca15e209d2a011af3d21', 'string': 'RPC #369384 failed: "failed to dial 12D3KooWEsc3KyWrxmDt8J8cBXBwztRrLcYrPKdJXWU4YLdC8z5z: all dials failed\\n  * [/ip4/185.25.49.250/tcp/8302] failed to negotiate security protocol: peer id mismatch: expected 12D3KooWEsc3KyWrxmDt8J8cBXBwztRrLcYrPKdJXWU4YLdC8z5z, but remote key matches 12D3KooWBLcxkHd3KQGeLiNgwVQ8ViEb5EYg3cmSjQs5tDDXQfQb"'}}
-            err_negotiate_security_protocol += 1
-          elif 'connection refused' in error_str:
-            #{'error': {'commit_id': 'baffb589965aa0a8552dca15e209d2a011af3d21', 'string': 'RPC #369418 failed: "failed to dial 12D3KooWKWzRb7BN7J3zXF6PkRn3sJMRBxvq58ujoTHSUHcNmWdc: all dials failed\\n  * [/ip4/178.170.47.23/tcp/35592] dial tcp4 178.170.47.23:35592: connect: connection refused"'}}
-            err_connection_refused +=1
-          elif 'timed out requesting node status data from peer' in error_str:
-            err_time_out += 1
-          elif 'node status data was greater than' in error_str:
-            print("Errored response: {}".format(error_str))
-            err_size_limit_exceeded +=1
-          elif 'stream reset' in error_str:
-            err_stream_reset += 1
-          else:
-            print("Errored response: {}".format(error_str))
-            err_others += 1
-        except:
-          print("Errored response: {}".format(p))
-          err_others += 1
+      error_counts, libp2p_counts = error_classifier.count_errors(error_resps)
+      libp2p_error_counts.update(libp2p_counts)
 
       print('\t%s valid responses from peers'%(str(len(list(peers)))))
       print('\t%s error responses'%(str(len(list(error_resps)))))
       print('=========================')        
-      print('\t%s context deadline exceeded'%(str(err_context_deadline)))
-      print('\t%s failed to negotiate security protocol'%(str(err_negotiate_security_protocol)))
-      print('\t%s connection refused'%(str(err_connection_refused)))
-      print('\t%s timed out requesting node status data from peer'%(str(err_time_out)))
-      print('\t%s node status data size exceed limit'%(str(err_size_limit_exceeded)))
-      print('\t%s stream reset'%(str(err_stream_reset)))
-      print('\t%s other errors'%(str(err_others)))
+      print('\t%s context deadline exceeded'%(str(error_counts['context_deadline_exceeded'])))
+      print('\t%s failed to negotiate security protocol'%(str(error_counts['failed_security_protocol_negotiation'])))
+      print('\t%s connection refused'%(str(error_counts['connection_refused'])))
+      print('\t%s timed out requesting node status data from peer'%(str(error_counts['timed_out'])))
+      print('\t%s node status data size exceed limit'%(str(error_counts['size_limit_exceeded'])))
+      print('\t%s stream reset'%(str(error_counts['stream_reset'])))
+      print('\t%s other errors'%(str(error_counts['other'])))
       print('=========================')
       #if len(errors) > 100:
       #  import IPython; IPython.embed()
@@ -264,19 +229,6 @@ def main():
         else :
           uptime_greater_than_24_hour.append(uptime)
 
-      for e in error_resps:
-        error = str(e['error'])
-        if 'handshake error' in error:
-          node_status_handshake_errors.append(e)
-        elif 'heartbeats' in error:
-          node_status_heartbeat_errors.append(e)
-        elif 'transport stopped' in error:
-          node_status_transport_stopped_errors.append(e)
-        elif 'libp2p' in error:
-          node_status_libp2p_errors.append(e)
-        else:
-          node_status_other_errors.append(e)
-
     print ('Gathering node_status from daemon peers')
 
     seed_status = exec_command("mina client status")
@@ -291,16 +243,84 @@ def main():
     slots_per_epoch = int(get_status_value('Slots per epoch'))
     global_slot = epoch*slots_per_epoch + slot
 
-    for seed in seeds:
-      seed_pod = [ p for p in pods.to_dict()['items'] if p['metadata']['name'] == seed ][0]
-      seed_daemon_container = [ c for c in seed_pod['spec']['containers'] if c['args'][0] == 'daemon' ][0]
-      seed_vars_dict = [ v for v in seed_daemon_container['env'] ]
-      seed_daemon_port = [ v['value'] for v in seed_vars_dict if v['name'] == 'DAEMON_CLIENT_PORT'][0]
-
-      cmd = "mina advanced node-status -daemon-port " + seed_daemon_port + " -daemon-peers" + " -show-errors"
-      resp = util.exec_on_pod(v1, namespace, seed, 'coda', cmd)
-
-      add_resp(resp)
+    def query_seed(seed):
+      # a seed that only got a worker after the deadline isn't queried at all
+      if crawl_finished.is_set():
+        return
+
+      if seed in checkpoint.seeds_done:
+        print('seed {}: already queried by the crawl being resumed'.format(seed))
+        return
+
+      seed_daemon_port = pod_inventory.daemon_client_port(inventory.get(seed))
+
+      if args.incremental or resuming:
+        # the seed's current peers are cheap to list, only the ones without a response in the checkpoint or a fresh cached response are sent node
+        # status queries
+        peers = util.exec_on_pod(v1, namespace, seed, 'coda', "mina advanced get-peers", args.seed_deadline_seconds).split()
+        _, peers_left = checkpoint.split(peers)
+        with merge_lock:
+          cached, stale = cache.split(peers_left) if args.incremental else ([], peers_left)
+        print('seed {}: {} peers, {} already in the checkpoint, {} cached responses reused, {} to query'.format(seed, len(peers), len(peers) - len(peers_left), len(cached), len(stale)))
+        merge(cached, fetched=False)
+        if len(stale) == 0:
+          seed_finished(seed)
+          return
+        cmd = "mina advanced node-status -daemon-port " + seed_daemon_port + " -peers " + ",".join(stale) + " -show-errors"
+      else:
+        cmd = "mina advanced node-status -daemon-port " + seed_daemon_port + " -daemon-peers" + " -show-errors"
+
+      if crawl_finished.is_set():
+        return
+      daemon_unreachable = []
+
+      def resp_lines():
+        for s in util.exec_on_pod_lines(v1, namespace, seed, 'coda', cmd, args.seed_deadline_seconds):
+          if 'Error: Unable to connect to Mina Daemon.' in s:
+            daemon_unreachable.append(s)
+            return
+          yield s
+
+      add_resp(resp_lines())
+      # the responses are merged as they arrive, so those received before a seed fails stay in the report. raising puts the seed in
+      # seeds_failed, which marks the report as partial data
+      if len(daemon_unreachable) > 0:
+        raise Exception('seed {} could not connect to its daemon'.format(seed))
+      seed_finished(seed)
+
+    def seed_finished(seed):
+      with merge_lock:
+        if not crawl_finished.is_set():
+          checkpoint.seed_done(seed)
+
+    if resuming:
+      print('resuming the crawl started at {}: {} responses, {} of {} seeds done'.format(
+        datetime.fromtimestamp(checkpoint.started_at), len(checkpoint.resps), len(checkpoint.seeds_done.intersection(seeds)), len(seeds)))
+      merge(list(checkpoint.resps.values()), fetched=False)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.seed_concurrency)
+    futures = { executor.submit(query_seed, s): s for s in seeds }
+    done, not_done = concurrent.futures.wait(futures, timeout=args.seed_deadline_seconds)
+    with merge_lock:
+      crawl_finished.set()
+    # the seeds still waiting for a worker are cancelled, and the ones being queried don't start another command. the commands already running
+    # time out on their own, at most seed_deadline_seconds after they started
+    for f in not_done:
+      f.cancel()
+    executor.shutdown(wait=False)
+
+    seeds_timed_out = sorted(futures[f] for f in not_done)
+    seeds_failed = sorted(futures[f] for f in done if f.exception() is not None)
+    for f in done:
+      if f.exception() is not None:
+        print('failed to query seed {}: {}'.format(futures[f], ''.join(traceback.format_exception(type(f.exception()), f.exception(), f.exception().__traceback__))))
+    for s in seeds_timed_out:
+      print('seed {} did not finish within {} seconds, reporting without the rest of its responses'.format(s, args.seed_deadline_seconds))
+    partial_data = len(seeds_timed_out) + len(seeds_failed) > 0
+
+    cache.save()
+    # a partial crawl is picked up where it left off by the next run
+    checkpoint.close(complete=not partial_data)
 
     peer_numbers = [ len(node['peers']) for node in peer_table.values() ]
     peer_percentiles = [ 0, 5, 25, 50, 95, 100 ]
@@ -310,45 +330,29 @@ def main():
     else:
       peer_percentile_numbers = []
 
+    # the peer graph of the responding peers: whether the network is partitioned, how many hops across it is and which peers hold it together
+    peer_graph = topology.analyze(*topology.build((pv['node_peer_id'], [ p['peer_id'] for p in pv['peers'] ]) for pv in peer_table.values()))
+
     block_producers = list(itertools.chain(*[ pv['block_producers'] for pv in peer_table.values() ]))
 
-    if len(peer_table) > 0 and 'k_block_hashes' in list(peer_table.values())[0]:
-      peer_to_k_block_hashes = { p: pv['k_block_hashes'] for p,pv in  peer_table.items() }
-    else:
-      peer_to_k_block_hashes = { p: [ a[0] for a in pv['k_block_hashes_and_timestamps'] ] for p,pv in  peer_table.items() }
-
-    fork_tree = {}
-
-    for block_hashes in peer_to_k_block_hashes.values():
-      parents = block_hashes
-      children_or_none = [ [ c ] for c in block_hashes[1:] ] + [ [] ]
-      for parent, child_or_none in zip(parents, children_or_none):
-        fork_tree.setdefault(parent, { 'children': set(), 'peers': 0 })
-        fork_tree[parent]['children'].update(child_or_none)
-        fork_tree[parent]['peers'] += 1
-
-    children = list(itertools.chain(*[ v['children'] for v in fork_tree.values() ]))
-    roots = set(fork_tree.keys()).difference(children)
-
-    summarized_fork_tree = {}
-
-    def add_to_summarized_tree(parent):
-      peers = fork_tree[parent]['peers']
-      children = fork_tree[parent]['children']
-      intermediate_nodes = 0
-      while len(children) == 1 and fork_tree[list(children)[0]]['peers'] == peers:
-        children_or_none = fork_tree[list(children)[0]]['children']
-        if len(children_or_none) > 0:
-          children = fork_tree[list(children)[0]]['children']
-          intermediate_nodes += 1
-        else:
-          break
-      summarized_fork_tree[parent] = { 'children': children, 'peers': peers, 'intermediate_nodes': intermediate_nodes }
-      for child in children:
-        add_to_summarized_tree(child)
-
-    for root in roots:
-      add_to_summarized_tree(root)
+    # responses from the peer cache only have the hashes
+    k_block_hashes = lambda pv: pv['k_block_hashes'] if 'k_block_hashes' in pv else [ a[0] for a in pv['k_block_hashes_and_timestamps'] ]
+    peer_to_k_block_hashes = { p: k_block_hashes(pv) for p,pv in  peer_table.items() }
+
+    # the chains are interned into integer ids once, and the block tree (parent links and the number of peers with each block) is built with array operations
+    index = block_index.BlockIndex()
+    chains = [ index.intern_chain(block_hashes) for block_hashes in peer_to_k_block_hashes.values() ]
+    for chain in chains:
+      index.link(chain)
+    block_peers = np.bincount(np.concatenate(chains), minlength=len(index)) if len(chains) > 0 else np.zeros(0, dtype=np.int64)
+
+    fork_tree = { index.hash(b): { 'children': set(), 'peers': int(block_peers[b]) } for b in range(len(index)) }
+    for child, parent in zip(*index.links()):
+      fork_tree[index.hash(parent)]['children'].add(index.hash(child))
+
+    roots = set(index.hash(b) for b in np.nonzero(index.parent[:len(index)] < 0)[0])
+
+    summarized_fork_tree = block_tree_summary.summarize(fork_tree, roots)
 
     def has_forks():
       roots_with_children = [ root for root in roots if len(fork_tree[root]['children']) > 0 ]
@@ -411,45 +415,23 @@ def main():
                                'protocol_state_hash': v['protocol_state_hash'],
                                'discord(s)': value_to_discords(v)  } for k,v in peer_table.items() }
 
-    new_fname = 'peer_table.' + str(time.time()) + '.txt'
-    with open(new_fname, 'w') as wfile:
-      wfile.write(json.dumps(peer_table_dict))
-
-    files = [f for f in listdir('.') if isfile(join('.', f))]
-
-    windows_in_hours = [ 1, 3, 6, 12, 24, 72, 24*7 ]
-
-    responding_peers_by_window = {}
-    responding_ips_by_window = {}
-    responding_discords_by_window = {}
-
-    oldest_report = time.time()
     now = time.time()
 
-    for fname in files:
-      if 'peer_table' not in fname or fname.startswith('.') or not fname.endswith('txt'):
-        continue
-      with open(fname, 'r') as f:
-        contents = f.read()
-        peers = ast.literal_eval(contents)
-
-        file_timestamp = float('.'.join(fname.split('.')[1:-1]))
+    history = history_store.HistoryStore(args.history_db)
+    # picks up the history earlier versions kept in peer_table.<timestamp>.txt files
+    history.import_peer_table_files()
+    history.record(now, list(peer_table.keys()), [ d for v in peer_table.values() for d in value_to_discords(v) if d != '' ])
+    history.apply_retention(now)
 
-        oldest_report = min(oldest_report, file_timestamp)
-
-        ip_peer_ids = set(peers.keys())
-        ips = set(map(lambda x: ast.literal_eval(x)[0], ip_peer_ids))
-        discords = set(itertools.chain(*map(lambda x: x['discord(s)'], peers.values())))
+    windows_in_hours = [ 1, 3, 6, 12, 24, 72, 24*7 ]
 
-        for w in windows_in_hours:
-          responding_peers_by_window.setdefault(w, set())
-          responding_ips_by_window.setdefault(w, set())
-          responding_discords_by_window.setdefault(w, set())
+    unique_in_windows = history.unique_in_windows(windows_in_hours, now)
+    responding_peers_by_window = unique_in_windows['peers']
+    responding_ips_by_window = unique_in_windows['ips']
+    responding_discords_by_window = unique_in_windows['discords']
 
-          if (now - file_timestamp) <= w*3600:
-            responding_peers_by_window[w].update(ip_peer_ids)
-            responding_ips_by_window[w].update(ips)
-            responding_discords_by_window[w].update(discords)
+    oldest_report = history.oldest_run()
+    history.close()
 
 
     # ==========================================
@@ -459,11 +441,11 @@ def main():
       "namespace": args.namespace,
       "queried_nodes": len(queried_peers),
       "responding_nodes": len(peer_table),
-      "node_status_handshake_errors": len(node_status_handshake_errors),
-      "node_status_heartbeat_errors": len(node_status_heartbeat_errors),
-      "node_status_transport_stopped_errors": len(node_status_transport_stopped_errors),
-      "node_status_libp2p_errors": len(node_status_libp2p_errors),
-      "node_status_other_errors": len(node_status_other_errors),
+      "node_status_handshake_errors": libp2p_error_counts['handshake'],
+      "node_status_heartbeat_errors": libp2p_error_counts['heartbeats'],
+      "node_status_transport_stopped_errors": libp2p_error_counts['transport_stopped'],
+      "node_status_libp2p_errors": libp2p_error_counts['libp2p'],
+      "node_status_other_errors": libp2p_error_counts['other'],
       "uptime_less_than_10_min": len(uptime_less_than_10_min),
       "uptime_less_than_30_min": len(uptime_less_than_30_min),
       "uptime_less_than_1_hour": len(uptime_less_than_1_hour),
@@ -477,8 +459,15 @@ def main():
       "blocks": blocks,
       "block_fill_rate": blocks / global_slot,
       "number_of_peer_percentiles": peer_percentile_numbers, # TODO add health indicator
+      "peer_graph": peer_graph,
       "summarized_block_tree": summarized_fork_tree,
       "has_forks": has_forks(),
+      "partial_data": partial_data,
+      "seeds_queried": len(seeds),
+      "resumed_responses": resumed_responses,
+      "resumed_from": checkpoint.started_at if resuming else None,
+      "seeds_timed_out": seeds_timed_out,
+      "seeds_failed": seeds_failed,
       "has_participants": has_participants,
       "participants_online": participants_online,
       "participants_offline": participants_offline,
@@ -500,32 +489,16 @@ def main():
 
     # ==========================================
 
-    # TODO
-    # display of network connectivity
-
-    def make_block_tree_graph():
-      g = Digraph("block_tree", format='png')
-      g.attr('node', shape='circle')
-      for block in summarized_fork_tree:
-        g.node(block, label='block ' + block[-6:] + '\n' + str(summarized_fork_tree[block]['peers']) + ' nodes')
-      g.attr('node', shape='rectangle', style='filled', color='lightgrey')
-      for block in summarized_fork_tree:
-        children = summarized_fork_tree[block]['children']
-        intermediate_nodes = summarized_fork_tree[block]['intermediate_nodes']
-        if len(children) > 0:
-          if intermediate_nodes > 0:
-            g.node(block + '_intermediate', label=str(intermediate_nodes) + ' in common blocks')
-            g.edge(block, block + '_intermediate')
-            for child in children:
-              g.edge(block + '_intermediate', child)
-          else:
-            for child in children:
-              g.edge(block, child)
-      g.render(view=False)
-
-    make_block_tree_graph()
-
-    copy = [ 'namespace', 'queried_nodes', 'responding_nodes', 'epoch', 'epoch_slot', 'global_slot', 'blocks', 'block_fill_rate', 'has_forks', 'has_participants',
+    # during forky periods the full tree is far too big to read (or for dot to lay out quickly), so only the biggest branches are drawn
+    displayed_tree = block_tree_summary.apply_budget(summarized_fork_tree, max_nodes=args.tree_max_nodes, max_forks=args.tree_max_forks, min_peers=args.tree_min_peers)
+    if args.tree_format == 'svg':
+      block_tree_file = block_tree_summary.render_svg(displayed_tree)
+    elif args.tree_format == 'json':
+      block_tree_file = block_tree_summary.render_json(displayed_tree)
+    else:
+      block_tree_file = block_tree_summary.render_graphviz(displayed_tree)
+
+    copy = [ 'namespace', 'queried_nodes', 'responding_nodes', 'epoch', 'epoch_slot', 'global_slot', 'blocks', 'block_fill_rate', 'has_forks', 'partial_data', 'seeds_queried', 'resumed_responses', 'has_participants',
              'node_status_handshake_errors', 'node_status_heartbeat_errors', 'node_status_transport_stopped_errors', 'node_status_libp2p_errors', 'node_status_other_errors',
              'uptime_less_than_10_min', 'uptime_less_than_30_min', 'uptime_less_than_1_hour', 'uptime_less_than_6_hour', 'uptime_less_than_12_hour',
              'uptime_less_than_24_hour', 'uptime_greater_than_24_hour' ]
@@ -537,11 +510,17 @@ def main():
     json_report['participants_offline'] = len(report['participants_offline'])
 
     json_report['number_of_peer_percentiles'] = ' | '.join([ str(p) + '%: ' + str(v) for (p,v) in report['number_of_peer_percentiles'] ])
+    graph = report['peer_graph']
+    json_report['peer_graph'] = '{} nodes, {} edges, {} partitions (largest component has {:.1%}), {} isolated nodes, diameter about {}, {} articulation points'.format(
+      graph['nodes'], graph['edges'], graph['partitions'], graph['largest_component_fraction'], graph['isolated_nodes'], graph['diameter_estimate'], len(graph['articulation_points']))
+    # isolated nodes (whose peers all failed to respond) and small islands are common and don't count as a partition
+    if graph['partitions'] > 1:
+      json_report['peer_graph'] += ' :warning:'
+    json_report['peer_graph_degree_percentiles'] = ' | '.join([ str(p) + '%: ' + str(v) for (p,v) in graph['degree_percentiles'] ])
     json_report['oldest_responses_report'] = str((now - report['oldest_responses_report'])/3600) + ' hours old'
 
     def format_responses_in_window(responding_in_window):
-      responses_in_window = { k: len(v) for (k,v) in responding_in_window.items() }
-      string = ' | '.join([ str(p) + ' hours: ' + str(v) for (p,v) in responses_in_window.items() ])
+      string = ' | '.join([ str(p) + ' hours: ' + str(v) for (p,v) in responding_in_window.items() ])
       return string
 
     json_report['unique_responding_peers_in_window'] = format_responses_in_window(report['responding_peers_by_window'])
@@ -551,6 +530,14 @@ def main():
     if json_report['has_forks']:
       json_report['has_forks'] = str(json_report['has_forks']) + ' :warning:'
 
+    # the numbers above only cover the seeds that answered in time
+    if report['partial_data']:
+      json_report['partial_data'] = 'True :warning: responses from the seeds that timed out or failed part way are included as far as they got. timed out: {}, failed: {}'.format(', '.join(report['seeds_timed_out']) or 'none', ', '.join(report['seeds_failed']) or 'none')
+
+    # responses carried over from an earlier, interrupted run are not current
+    if report['resumed_responses'] > 0:
+      json_report['resumed_responses'] = '{} :warning: from the crawl started {:.0f} minutes ago'.format(report['resumed_responses'], (now - report['resumed_from'])/60)
+
     if json_report['block_fill_rate'] < .75 - .10:
       json_report['block_fill_rate'] = str(json_report['block_fill_rate']) + ' :warning:'
 
@@ -559,24 +546,26 @@ def main():
     print(formatted_report)
 
     if discord_webhook_url is not None and len(discord_webhook_url) > 0:
-      if len(formatted_report) > discord_char_limit - 5:
-        formatted_report = formatted_report[:discord_char_limit - 5] + '...'
-
-
-      webhook = DiscordWebhook(url=discord_webhook_url, content=formatted_report)
-
-      with open("block_tree.gv.png", "rb") as f:
-        webhook.add_file(file=f.read(), filename='block_tree.gv.png')
+      # the report goes out page by page while the attachments are put together
+      delivery = discord_delivery.DiscordDelivery(discord_webhook_url).start()
+      delivery.send(formatted_report)
 
-      webhook.add_file(file=str(report['participants_online']), filename='particpants_online.txt')
-      webhook.add_file(file=str(report['participants_offline']), filename='participants_offline.txt')
-      webhook.add_file(file=str(report['online_discord_counts']), filename='online_discord_counts.txt')
+      with open(block_tree_file, "rb") as f:
+        block_tree = f.read()
 
       peer_table_str = json.dumps(peer_table_dict, indent=2)
 
-      webhook.add_file(file=peer_table_str, filename='peer_table.txt')
+      delivery.send(files=[
+        (os.path.basename(block_tree_file), block_tree),
+        ('particpants_online.txt', str(report['participants_online'])),
+        ('participants_offline.txt', str(report['participants_offline'])),
+        ('online_discord_counts.txt', str(report['online_discord_counts'])),
+        ('articulation_points.txt', '\n'.join(report['peer_graph']['articulation_points'])),
+        ('peer_table.txt', peer_table_str),
+      ])
 
-      webhook.execute()
+      if not delivery.close():
+        print('some of the report could not be delivered to discord')
 
 if __name__ == "__main__":
   try:
@@ -587,7 +576,6 @@ if __name__ == "__main__":
     print(str(namespace) + " exited with error", trace)
     if discord_webhook_url is not None and len(discord_webhook_url) > 0:
       msg = str(namespace) + " exited with error: " + str(trace)
-      if len(msg) > discord_char_limit - 5:
-        msg = msg[:discord_char_limit - 5] + '...'
-      webhook = DiscordWebhook(url=discord_webhook_url, content=msg)
-      response = webhook.execute()
+      delivery = discord_delivery.DiscordDelivery(discord_webhook_url).start()
+      delivery.send(msg)
+      delivery.close()
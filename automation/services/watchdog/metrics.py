@@ -2,44 +2,51 @@
 import itertools
 import datetime
 import util
+import instrumentation
 import asyncio
 import random
 import os
 import sys
 import traceback
-import subprocess
 import time
 import json
 import urllib.request
 import ast
+import concurrent.futures
+
+from kubernetes.client.rest import ApiException
 
-from google.cloud import storage
 
 # ========================================================================
 
-def collect_cluster_crashes(v1, namespace, cluster_crashes):
+def collect_cluster_crashes(v1, namespace, inventory, restart_tracker, cluster_crashes):
   print('collecting cluster crashes / restarts')
-  pods = v1.list_namespaced_pod(namespace, watch=False)
+  pods = inventory.pods(running=True)
+
+  containers = list(itertools.chain(*[ [ (pod.metadata.name, c) for c in pod.status.container_statuses or [] ] for pod in pods ]))
+  mina_containers = list(filter(lambda c: c[1].name in [ 'coda', 'seed', 'coordinator', 'archive' ], containers))
 
-  containers = list(itertools.chain(*[ pod.to_dict()['status']['container_statuses'] for pod in pods.items if pod.status.phase == 'Running' ]))
-  mina_containers = list(filter(lambda c: c['name'] in [ 'coda', 'seed', 'coordinator', 'archive' ], containers))
+  # the tracker sees every restart, including containers that restarted more than once since the last run
+  tracked_restarts = restart_tracker.restarted_within(30*60)
 
-  def restarted_recently(c):
+  def restarted_recently(pod_name, c):
+    if (pod_name, c.name) in tracked_restarts:
+      return True
 
-    if c['restart_count'] == 0:
+    if c.restart_count == 0:
       return False
 
-    terminated = c['last_state']['terminated']
+    terminated = c.last_state.terminated
     if terminated is None:
       return False
 
-    restart_time = terminated['started_at']
+    restart_time = terminated.started_at
     retart_age_seconds = (datetime.datetime.now(datetime.timezone.utc) - restart_time).total_seconds()
 
     # restarted less than 30 minutes ago
     return retart_age_seconds <= 30*60
 
-  recently_restarted_containers = list(filter(lambda c: restarted_recently(c), mina_containers))
+  recently_restarted_containers = list(filter(lambda c: restarted_recently(*c), mina_containers))
 
   fraction_recently_restarted = len(recently_restarted_containers)/len(mina_containers)
   print(len(recently_restarted_containers), 'of', len(mina_containers), 'recently restarted')
@@ -48,30 +55,80 @@ def collect_cluster_crashes(v1, namespace, cluster_crashes):
 
 # ========================================================================
 
-def pods_with_no_new_logs(v1, namespace, nodes_with_no_new_logs):
+def collect_restart_analytics(restart_tracker, restarts_per_hour, mean_time_between_failures, crash_looping_containers):
+  rates, mtbf, crash_looping = restart_tracker.stats()
+  print('restarts per hour by role: {}, crash looping containers by role: {}'.format(rates, crash_looping))
+
+  # roles come and go, so start from a clean set of labels each time
+  for gauge, values in [ (restarts_per_hour, rates), (mean_time_between_failures, mtbf), (crash_looping_containers, crash_looping) ]:
+    gauge.clear()
+    for role, value in values.items():
+      gauge.labels(role=role).set(value)
+
+# ========================================================================
+
+# returned by last_log_age for a pod whose logs couldn't be read
+unreadable = 'unreadable'
+
+# seconds since the container's last log line, or None if it has never logged. only the last line is fetched (with its timestamp) rather than the logs themselves.
+# the pods come from the inventory, which can lag behind the cluster: a pod deleted or restarted since its last event is unreadable rather than failing the whole run
+def last_log_age(v1, namespace, pod_name, container):
+  try:
+    last_line = v1.read_namespaced_pod_log(name=pod_name, namespace=namespace, container=container, tail_lines=1, timestamps=True, limit_bytes=4096)
+  except ApiException as e:
+    print("could not read the logs of pod {} ({}), skipping it: {}".format(pod_name, e.status, e.reason))
+    return unreadable
+  if last_line.strip() == '':
+    return None
+
+  # e.g. 2021-07-16T21:01:17.12345Z (trailing zeros are trimmed), python only handles microseconds
+  seconds, _, fraction = last_line.split(' ', 1)[0].rstrip('Z').partition('.')
+  logged_at = datetime.datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+  logged_at += datetime.timedelta(microseconds=int((fraction + '000000')[:6]))
+
+  return (datetime.datetime.now(datetime.timezone.utc) - logged_at).total_seconds()
+
+def pods_with_no_new_logs(v1, namespace, inventory, nodes_with_no_new_logs, pod_last_log_age):
   print('counting pods with no new logs')
-  pods = v1.list_namespaced_pod(namespace, watch=False)
+  pods = inventory.pods()
 
   one_hour = 60 * 60
 
-  count = 0
+  to_check = []
   total_running_pods = 0
-  for pod in pods.items:
+  for pod in pods:
     if pod.status.phase == 'Running':
       total_running_pods += 1
       containers = pod.status.container_statuses
       mina_containers = list(filter(lambda c: c.name in [ 'coda', 'seed', 'coordinator' ], containers))
       if len(mina_containers) != 0:
-        name = pod.metadata.name
-        recent_logs = v1.read_namespaced_pod_log(name=name, namespace=namespace, since_seconds=one_hour, container=mina_containers[0].name)
-        if len(recent_logs) == 0:
-          print("Pod {} has no logs for the last hour".format(name))
-          count += 1
+        to_check.append((pod.metadata.name, mina_containers[0].name))
     else:
       print("Pod {} is not running. Phase: {}, reason: {}".format(pod.metadata.name,pod.status.phase, pod.status.reason))
 
-  fraction_no_new_logs = float(count) / float(total_running_pods)
-  print(count, 'of', total_running_pods, 'pods have no logs in the last 10 minutes')
+  concurrency = int(os.environ.get('LOG_CHECK_CONCURRENCY', 16))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+    ages = dict(zip([ name for name, _ in to_check ], executor.map(instrumentation.wrap(lambda c: last_log_age(v1, namespace, *c)), to_check)))
+
+  # most likely gone since the inventory last heard of them, they're left out of both counts
+  skipped = [ name for name, age in ages.items() if age is unreadable ]
+  ages = { name: age for name, age in ages.items() if age is not unreadable }
+  total_running_pods -= len(skipped)
+
+  count = 0
+  for name, age in ages.items():
+    if age is None or age > one_hour:
+      print("Pod {} has no logs for the last hour".format(name))
+      count += 1
+
+  # pods come and go, so start from a clean set of labels each time
+  pod_last_log_age.clear()
+  for name, age in ages.items():
+    if age is not None:
+      pod_last_log_age.labels(pod=name).set(age)
+
+  fraction_no_new_logs = float(count) / float(total_running_pods) if total_running_pods > 0 else 0
+  print(count, 'of', total_running_pods, 'pods have no logs in the last hour')
 
   nodes_with_no_new_logs.set(fraction_no_new_logs)
 
@@ -81,39 +138,28 @@ from node_status_metrics import collect_node_status_metrics
 
 # ========================================================================
 
-def check_google_storage_bucket(v1, namespace, recent_google_bucket_blocks):
+def check_google_storage_bucket(v1, namespace, bucket_watcher, recent_google_bucket_blocks, google_bucket_upload_rate, google_bucket_max_upload_gap):
   print('checking google storage bucket')
 
-  bucket = 'mina_network_block_data'
-  now = time.time()
-
-  storage_client = storage.Client()
-  blobs = list(storage_client.list_blobs(bucket, prefix=namespace))
-
-  blob_ages = [ now - b.generation/1e6 for b in blobs ]
+  with instrumentation.span('list_objects'):
+    bucket_watcher.check()
 
-  newest_age = min([ age for age in blob_ages ])
+  print("highest block seen in the google storage bucket: {}".format(bucket_watcher.max_height))
 
-  end = time.time()
-
-  print("Checking google storage bucket took {} seconds".format(end-now))
-
-  recent_google_bucket_blocks.set(newest_age)
+  recent_google_bucket_blocks.set(bucket_watcher.newest_age())
+  google_bucket_upload_rate.set(bucket_watcher.uploads_per_hour())
+  google_bucket_max_upload_gap.set(bucket_watcher.max_gap())
 
 # ========================================================================
 
-def daemon_containers(v1, namespace):
-  pods = v1.list_namespaced_pod(namespace, watch=False)
-
-  for pod in pods.items:
-    if pod.status.phase == 'Running':
-      containers = pod.status.container_statuses
-      for c in containers:
-        if c.name in [ 'coda', 'mina', 'seed']:
-          yield (pod.metadata.name, c.name)
+def daemon_containers(inventory):
+  for pod in inventory.pods(running=True):
+    for c in pod.status.container_statuses:
+      if c.name in [ 'coda', 'mina', 'seed']:
+        yield (pod.metadata.name, c.name)
 
-def get_chain_id(v1, namespace):
-  for (pod_name, container_name) in daemon_containers(v1, namespace):
+def get_chain_id(v1, namespace, inventory):
+  for (pod_name, container_name) in daemon_containers(inventory):
     try:
       resp = util.exec_on_pod(v1, namespace, pod_name, container_name, 'mina client status --json')      
       resp = resp.strip()
@@ -127,36 +173,35 @@ def get_chain_id(v1, namespace):
       print("Exception when extracting chain id on pod {}: {}\n mina client status response: {}".format(pod_name, e, resp))
       continue
 
-def check_seed_list_up(v1, namespace, seeds_reachable):
+def check_seed_list_up(v1, namespace, inventory, seed_peers_list_url, seed_prober, seeds_reachable, seed_availability, seed_dial_latency):
   print('checking seed list up')
-  start = time.time()
-
-  seed_peers_list_url = os.environ.get('SEED_PEERS_URL')
 
   with urllib.request.urlopen(seed_peers_list_url) as f:
     contents = f.read().decode('utf-8')
 
-  seeds =  ' '.join(contents.split('\n'))
-  #stdbuf -o0 is to disable buffering
+  seeds = [ s.strip() for s in contents.split('\n') if s.strip() != '' ]
+
+  if seed_prober.chain_id is None:
+    seed_prober.chain_id = get_chain_id(v1, namespace, inventory)
 
-  chain_id = get_chain_id(v1, namespace)
-  if chain_id is None:
+  if seed_prober.chain_id is None:
     print('could not get chain id')
   else:
-    command = 'stdbuf -o0 check_libp2p/check_libp2p ' + chain_id + ' ' + seeds
-    proc = subprocess.Popen(command,stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-    for line in proc.stderr.readlines():
-            print("check_libp2p error: {}".format(line))
-    val = proc.stdout.read()
-    print("check_libp2p output: {}".format(val))
-    proc.stdout.close()
-    proc.wait()
-
-    res = json.loads(val)
-    #checklibp2p returns whether or not the connection to a peerID errored
-    fraction_up = sum(res.values())/len(res.values())
-    end = time.time()
-    print("checking seed connection took {} seconds".format(end-start))
+    with instrumentation.span('dial'):
+      res = seed_prober.probe(seeds)
+    print("check_libp2p results: {}".format({ seed: r.up for seed, r in res.items() }))
+
+    fraction_up = sum(r.up for r in res.values())/len(res.values())
     seeds_reachable.set(fraction_up)
 
+    # seeds come and go from the list, so start from a clean set of labels each time
+    seed_availability.clear()
+    for seed, availability in seed_prober.availability().items():
+      seed_availability.labels(seed=seed).set(availability)
+
+    seed_dial_latency.clear()
+    for seed, percentiles in seed_prober.latency_percentiles().items():
+      for quantile, latency in percentiles.items():
+        seed_dial_latency.labels(seed=seed, quantile=str(quantile)).set(latency)
+
 # ========================================================================
@@ -0,0 +1,129 @@
+import collections
+import concurrent.futures
+import os
+import threading
+
+# ========================================================================
+
+# the namespaces to watch: a comma separated KUBERNETES_NAMESPACES, every namespace matching the label selector in KUBERNETES_NAMESPACE_SELECTOR
+# (which needs permission to list namespaces), or else just the watchdog's own namespace. the selector is only resolved at startup
+def watched_namespaces(v1, default_namespace):
+  if os.environ.get('KUBERNETES_NAMESPACES') is not None:
+    return [ ns.strip() for ns in os.environ['KUBERNETES_NAMESPACES'].split(',') if ns.strip() != '' ]
+  if os.environ.get('KUBERNETES_NAMESPACE_SELECTOR') is not None:
+    namespaces = v1.list_namespace(label_selector=os.environ['KUBERNETES_NAMESPACE_SELECTOR'])
+    return sorted(ns.metadata.name for ns in namespaces.items)
+  return [ default_namespace ]
+
+# the seed list to probe for a namespace: its entry in SEED_PEERS_URLS (comma separated namespace=url), or SEED_PEERS_URL when only one namespace
+# is watched. None when a namespace has no list of its own, rather than probing another testnet's seeds under its label
+def seed_peers_url(namespace, watched):
+  urls = dict(entry.strip().split('=', 1) for entry in os.environ.get('SEED_PEERS_URLS', '').split(',') if '=' in entry)
+  if namespace in urls:
+    return urls[namespace].strip()
+  if len(watched) == 1:
+    return os.environ.get('SEED_PEERS_URL')
+  return None
+
+# ========================================================================
+
+# the label names of each metric made by metric(), in order: prometheus_client's remove() takes the label values positionally
+label_names = {}
+
+def metric(cls, name, documentation, labelnames, **kwargs):
+  m = cls(name, documentation, labelnames, **kwargs)
+  label_names[m] = list(labelnames)
+  return m
+
+# (metric, namespace) -> the label sets set through Namespaced, so clear() can remove them. kept here rather than in Namespaced since a
+# wrapper is made for every collector run
+_label_sets = collections.defaultdict(set)
+_label_sets_lock = threading.Lock()
+
+# a metric with its namespace label filled in, so the collectors can keep calling .set(), .labels(seed=...), .clear() etc. without knowing about namespaces
+class Namespaced:
+
+  def __init__(self, metric, namespace):
+    self.metric = metric
+    self.namespace = namespace
+
+  def labels(self, **labels):
+    with _label_sets_lock:
+      _label_sets[(self.metric, self.namespace)].add(tuple(sorted(labels.items())))
+    return self.metric.labels(namespace=self.namespace, **labels)
+
+  def set(self, value):
+    self.labels().set(value)
+
+  def inc(self, amount=1):
+    self.labels().inc(amount)
+
+  def observe(self, value):
+    self.labels().observe(value)
+
+  # only removes this namespace's label sets, unlike clear() on the metric itself
+  def clear(self):
+    with _label_sets_lock:
+      stale = _label_sets.pop((self.metric, self.namespace), set())
+    for labels in stale:
+      labels = dict(labels, namespace=self.namespace)
+      self.metric.remove(*[ labels[name] for name in label_names[self.metric] ])
+
+# ========================================================================
+
+# runs the collectors of every namespace on one set of threads. queued runs are started round robin across the namespaces, and no namespace
+# gets more than max_per_namespace threads at once, so a namespace with slow collectors (e.g. a big network's node status) can't starve the others
+class FairScheduler:
+
+  def __init__(self, threads, max_per_namespace=None):
+    self.max_per_namespace = max_per_namespace or threads
+    self._lock = threading.Condition()
+    self._queues = collections.OrderedDict()
+    self._running = collections.Counter()
+    for i in range(threads):
+      threading.Thread(target=self._work, name='collector-{}'.format(i), daemon=True).start()
+
+  def submit(self, namespace, fn, *args):
+    future = concurrent.futures.Future()
+    with self._lock:
+      self._queues.setdefault(namespace, collections.deque()).append((future, fn, args))
+      self._lock.notify()
+    return future
+
+  # an executor for one namespace, to hand to run_periodically / run_in_executor
+  def executor(self, namespace):
+    scheduler = self
+    class NamespaceExecutor(concurrent.futures.Executor):
+      def submit(self, fn, *args):
+        return scheduler.submit(namespace, fn, *args)
+    return NamespaceExecutor()
+
+  def _next(self):
+    for namespace, queue in self._queues.items():
+      if len(queue) > 0 and self._running[namespace] < self.max_per_namespace:
+        # the namespace goes to the back of the line
+        self._queues.move_to_end(namespace)
+        return namespace, queue.popleft()
+    return None, None
+
+  def _work(self):
+    while True:
+      with self._lock:
+        namespace, job = self._next()
+        while job is None:
+          self._lock.wait()
+          namespace, job = self._next()
+        self._running[namespace] += 1
+
+      future, fn, args = job
+      try:
+        if future.set_running_or_notify_cancel():
+          try:
+            future.set_result(fn(*args))
+          except BaseException as e:
+            future.set_exception(e)
+      finally:
+        with self._lock:
+          self._running[namespace] -= 1
+          # a namespace that was at its limit may have queued work
+          self._lock.notify_all()
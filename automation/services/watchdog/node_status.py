@@ -0,0 +1,111 @@
+import ast
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import instrumentation
+
+try:
+  import orjson
+  loads = orjson.loads
+except ImportError:
+  loads = json.loads
+
+# ========================================================================
+
+# the only parts of a node status response the watchdog and the report read, everything else is dropped as soon as a line is parsed
+node_status_fields = [
+  'node_peer_id',
+  'node_ip_addr',
+  'sync_status',
+  'protocol_state_hash',
+  'k_block_hashes_and_timestamps',
+  'k_block_hashes',
+  'peers',
+  'block_producers',
+  'git_commit',
+  'uptime_minutes',
+  'error',
+]
+
+def project(resp, fields=node_status_fields):
+  return { k: resp[k] for k in fields if k in resp }
+
+def decode_line(line, fields=node_status_fields):
+  try:
+    resp = loads(line)
+  except ValueError:
+    # responses sometimes contain properties with single quotes instead of double quotes, which ast handles
+    try:
+      resp = ast.literal_eval(line)
+    except (ValueError, SyntaxError) as e:
+      print('could not parse node status response: {}'.format(line[:200]))
+      return { 'error': { 'string': 'unparseable node status response: ' + str(e) } }
+  if not isinstance(resp, dict):
+    return { 'error': { 'string': 'unexpected node status response: ' + line[:200] } }
+  return project(resp, fields)
+
+def decode_batch(lines, fields=node_status_fields):
+  return [ decode_line(line, fields) for line in lines ]
+
+# ========================================================================
+
+batch_size = 1000
+# parsing is in-process unless NODE_STATUS_PARSE_WORKERS (more than 1) asks for a pool: the watchdog usually runs on a single cpu, where shipping
+# batches to another process only adds the pickling
+parse_workers = int(os.environ.get('NODE_STATUS_PARSE_WORKERS', 0))
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool():
+  global pool
+  with pool_lock:
+    if pool is None:
+      # forkserver rather than fork, the watchdog has threads running
+      pool = concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context('forkserver'))
+    return pool
+
+# parses node status lines as they arrive, yielding the projected responses in order.
+# with parse_workers set, big responses are parsed in batches on a process pool, with a bounded number of batches in flight. only the given fields
+# are sent back from the pool
+def decode_node_statuses(lines, fields=node_status_fields):
+  batch = []
+  in_flight = collections.deque()
+  # time spent parsing or waiting on the pool, rather than waiting for lines to arrive
+  parse_seconds = 0
+  line_count = 0
+
+  def timed(f, *args):
+    nonlocal parse_seconds
+    start = time.time()
+    result = f(*args)
+    parse_seconds += time.time() - start
+    return result
+
+  for line in lines:
+    if line.strip() == '':
+      continue
+    batch.append(line)
+    line_count += 1
+    if len(batch) < batch_size:
+      continue
+
+    if parse_workers <= 1:
+      yield from timed(decode_batch, batch, fields)
+    else:
+      in_flight.append(get_pool().submit(decode_batch, batch, fields))
+      while len(in_flight) > 2*parse_workers:
+        yield from timed(in_flight.popleft().result)
+    batch = []
+
+  while len(in_flight) > 0:
+    yield from timed(in_flight.popleft().result)
+
+  yield from timed(decode_batch, batch, fields)
+
+  instrumentation.observe_parse(line_count, parse_seconds)
@@ -2,6 +2,12 @@
 import itertools
 import datetime
 import util
+import pod_inventory
+import node_status
+import peer_table
+import topology
+import error_classifier
+import instrumentation
 import asyncio
 import random
 import os
@@ -12,6 +18,9 @@ import time
 import json
 import urllib.request
 import ast
+import concurrent.futures
+
+import numpy as np
 
 # ========================================================================
 
@@ -21,71 +30,33 @@ def peer_to_multiaddr(peer):
     peer['libp2p_port'],
     peer['peer_id'] )
 
-def collect_node_status_metrics(v1, namespace, nodes_synced_near_best_tip, nodes_synced, nodes_queried, nodes_responded, seed_nodes_queried, seed_nodes_responded, nodes_errored, context_deadline_exceeded, failed_security_protocol_negotiation, connection_refused_errors, size_limit_exceeded_errors, timed_out_errors, stream_reset_errors, other_connection_errors, prover_errors):
+def collect_node_status_metrics(v1, namespace, inventory, fork_tree, nodes_synced_near_best_tip, nodes_synced, nodes_queried, nodes_responded, seed_nodes_queried, seed_nodes_responded, nodes_errored, context_deadline_exceeded, failed_security_protocol_negotiation, connection_refused_errors, size_limit_exceeded_errors, timed_out_errors, stream_reset_errors, other_connection_errors, prover_errors, node_status_errors_by_category, nodes_by_blocks_behind, network_partitions, network_isolated_nodes, network_largest_component_fraction, network_diameter_estimate, network_articulation_points, network_peer_degree):
   print('collecting node status metrics')
 
-  start = time.time()
-
-  pods = v1.list_namespaced_pod(namespace, watch=False)
-
-  pod_names = [ p['metadata']['name'] for p in pods.to_dict()['items'] if p['status']['phase'] == 'Running' ]
-
-  seeds = [ p for p in pod_names if 'seed' in p ]
-
-  resp_count, valid_resps, error_resps = collect_node_status(v1, namespace, seeds, pods, seed_nodes_responded, seed_nodes_queried)
-
-  err_context_deadline = 0
-  err_negotiate_security_protocol = 0
-  err_connection_refused = 0
-  err_time_out = 0
-  err_stream_reset = 0
-  err_size_limit_exceeded = 0
-  err_others = 0
-
-  for p in error_resps:
-    try:
-      error_str = p['error']['string']
-      if 'context deadline exceeded' in error_str:
-        #{'error': {'commit_id': 'baffb589965aa0a8552dca15e209d2a011af3d21', 'string': 'RPC #369385 failed: "context deadline exceeded"'}}
-        err_context_deadline += 1
-      elif 'failed to negotiate security protocol' in error_str:
-        #{'error': {'commit_id': 'baffb589965aa0a8552dca15e209d2a011af3d21', 'string': 'RPC #369384 failed: "failed to dial 12D3KooWEsc3KyWrxmDt8J8cBXBwztRrLcYrPKdJXWU4YLdC8z5z: all dials failed\\n  * [/ip4/185.25.49.250/tcp/8302] failed to negotiate security protocol: peer id mismatch: expected 12D3KooWEsc3KyWrxmDt8J8cBXBwztRrLcYrPKdJXWU4YLdC8z5z, but remote key matches 12D3KooWBLcxkHd3KQGeLiNgwVQ8ViEb5EYg3cmSjQs5tDDXQfQb"'}}
-        err_negotiate_security_protocol += 1
-      elif 'connection refused' in error_str:
-        #{'error': {'commit_id': 'baffb589965aa0a8552dca15e209d2a011af3d21', 'string': 'RPC #369418 failed: "failed to dial 12D3KooWKWzRb7BN7J3zXF6PkRn3sJMRBxvq58ujoTHSUHcNmWdc: all dials failed\\n  * [/ip4/178.170.47.23/tcp/35592] dial tcp4 178.170.47.23:35592: connect: connection refused"'}}
-        err_connection_refused +=1
-      elif 'timed out requesting node status data from peer' in error_str:
-        err_time_out += 1
-      elif 'node status data was greater than' in error_str:
-        print("Errored response: {}".format(error_str))
-        err_size_limit_exceeded +=1
-      elif 'stream reset' in error_str:
-        err_stream_reset += 1
-      else:
-        print("Errored response: {}".format(error_str))
-        err_others += 1
-    except:
-      print("Errored response: {}".format(p))
-      err_others += 1
+  seeds = inventory.pod_names(role='seed', running=True)
+
+  resp_count, table = collect_node_status(v1, namespace, seeds, inventory, seed_nodes_responded, seed_nodes_queried, fork_tree.index)
+  valid_resps = table.peers()
+
+  error_counts, _ = error_classifier.count_errors(table.error_resps, node_status_errors_by_category)
 
   num_peers = len(valid_resps)
 
-  synced_fraction = sum([ p['sync_status'] == 'Synced' for p in valid_resps ]) / num_peers
+  synced_fraction = sum([ p.sync_status == 'Synced' for p in valid_resps ]) / num_peers
 
   nodes_queried.set(resp_count)
   nodes_responded.set(num_peers)
-  nodes_errored.set(len(error_resps))
-  context_deadline_exceeded.set(err_context_deadline)
-  failed_security_protocol_negotiation.set(err_negotiate_security_protocol)
-  connection_refused_errors.set(err_connection_refused)
-  stream_reset_errors.set(err_stream_reset)
-  size_limit_exceeded_errors.set(err_size_limit_exceeded)
-  timed_out_errors.set(err_time_out)
-  other_connection_errors.set(err_others)
+  nodes_errored.set(len(table.error_resps))
+  context_deadline_exceeded.set(error_counts['context_deadline_exceeded'])
+  failed_security_protocol_negotiation.set(error_counts['failed_security_protocol_negotiation'])
+  connection_refused_errors.set(error_counts['connection_refused'])
+  stream_reset_errors.set(error_counts['stream_reset'])
+  size_limit_exceeded_errors.set(error_counts['size_limit_exceeded'])
+  timed_out_errors.set(error_counts['timed_out'])
+  other_connection_errors.set(error_counts['other'])
   nodes_synced.set(synced_fraction)
 
   end = time.time()
-  print("Updating Coda_watchdog_nodes_synced took {} seconds".format(end-start))
 
   # -------------------------------------------------
 
@@ -93,129 +64,126 @@ def collect_node_status_metrics(v1, namespace, nodes_synced_near_best_tip, nodes
 
   # -------------------------------------------------
 
-  # note: k_block_hashes_and_timestamps is most recent last
-  chains = [ p['k_block_hashes_and_timestamps'] for p in valid_resps ]
-
-  tree = {}
-  parents = {}
-  for c in chains:
-    for (parent, child) in zip(c, c[1:]):
-      parent = parent[0]
-      child = child[0]
-      tree.setdefault(parent, set())
-      tree[parent].add(child)
-      parents[child] = parent
-
-  def get_deepest_child(p):
-    children_and_depths = []
-    children_and_depths.append((p, 0))
-    if p in tree:
-      for c in tree[p]:
-        child, depth = get_deepest_child(c)
-        children_and_depths.append((child, depth + 1))
-    return max(children_and_depths, key=lambda x: x[1])
-
-  #get the latest protocol states of each node and the length of the chain (to eliminate nodes that are newly joining or restarting without persisted frontier)
-  latest_protocol_states = [c[len(c)-1][0] for c in chains if len(c) >= 290 and len(c) > 0]
-  common_states = {}
-  for state_hash in latest_protocol_states:
-    if state_hash in common_states:
-      common_states[state_hash] = common_states[state_hash] + 1
-    else:
-      common_states[state_hash] = 1
+  # note: the chains are most recent last, and are already ids in the fork tree's block index
+  for p in valid_resps:
+    fork_tree.ingest(p.key(), p.chain)
+  fork_tree.retain_peers(set(table.records))
+  fork_tree.prune()
+
+  #the latest protocol states of nodes with a full chain (to eliminate nodes that are newly joining or restarting without persisted frontier)
+  common_states = fork_tree.tip_counts()
 
   print("Best protocol states and the number of nodes synced to it:{}".format(common_states))
 
-  most_common_best_protocol_state,_ = max(common_states.items(), key=lambda x: x[1])
+  most_common_best_protocol_state = fork_tree.most_common_tip()
 
   n = 3
-  last_n_protocol_states = [ most_common_best_protocol_state ]
-  for _ in range(n):
-    parent = last_n_protocol_states[-1]
-    if parent in parents:
-      last_n_protocol_states.append(parents[parent])
+  last_n_protocol_states = fork_tree.ancestors(most_common_best_protocol_state, n)
 
   print("Latest {} protocol states:{}".format(n+1, last_n_protocol_states))
 
-  any_hash_in_last_n = lambda peer: any([ p_hash in last_n_protocol_states for p_hash, _ in peer['k_block_hashes_and_timestamps'][-n:] ])
+  #don't include nodes that are in catchup or bootstrap state
+  synced_peers = [ p for p in valid_resps if p.sync_status == 'Synced' ]
 
-  synced_near_best_tip_num = [ any_hash_in_last_n(p) for p in valid_resps if p['sync_status'] == 'Synced' ]
+  # every synced peer's tip is compared with the last n blocks before the best tip at once
+  tips = [ p.chain[-1] if len(p.chain) > 0 else -1 for p in synced_peers ]
+  near, behind, found = fork_tree.blocks_behind(fork_tree.index.id(most_common_best_protocol_state), tips, n)
 
-  #don't include nodes that are in catchup or bootstrap state
-  all_synced_peers = [ p['sync_status'] == 'Synced' for p in valid_resps ]
+  synced_near_best_tip_fraction = near.sum() / len(synced_peers)
 
-  synced_near_best_tip_fraction = sum(synced_near_best_tip_num) / sum(all_synced_peers)
+  peers_out_of_sync=[("peer-id:"+p.peer_id, "state-hash:"+p.protocol_state_hash, "status:"+p.sync_status) for p, is_near in zip(synced_peers, near) if not is_near]
 
-  peers_out_of_sync=[("peer-id:"+p['node_peer_id'], "state-hash:"+p['protocol_state_hash'], "status:"+p['sync_status']) for p in valid_resps if not any_hash_in_last_n(p) and p['sync_status'] == 'Synced']
+  print("Number of  peers with 'Synced' status: {}\nPeers not synced near the best tip: {}".format(len(synced_peers), peers_out_of_sync))
 
-  print("Number of  peers with 'Synced' status: {}\nPeers not synced near the best tip: {}".format(sum(all_synced_peers), peers_out_of_sync))
+  # how many blocks behind the best tip the synced peers are (negative when ahead of it), or 'unknown' if their chain doesn't meet the best tip's within n blocks
+  depths, counts = np.unique(behind[found], return_counts=True)
+  nodes_by_blocks_behind.clear()
+  for depth, count in zip(depths, counts):
+    nodes_by_blocks_behind.labels(blocks_behind=str(depth)).set(count)
+  nodes_by_blocks_behind.labels(blocks_behind='unknown').set((~found).sum())
 
-  end2 = time.time()
-  print("Updating Coda_watchdog_nodes_synced_near_best_tip took {} seconds".format(end2-end))
+  # -------------------------------------------------
+
+  # the peer graph of the responding nodes. more than one partition means the network is split (as far as the seeds can see), and the
+  # articulation points are the nodes it would be split by if they went down
+  graph = topology.analyze(*topology.build(table.peer_lists()))
+
+  print("Peer graph: {} nodes, {} edges, {} partitions, {} isolated nodes, diameter about {}, {} articulation points".format(
+    graph['nodes'], graph['edges'], graph['partitions'], graph['isolated_nodes'], graph['diameter_estimate'], len(graph['articulation_points'])))
+
+  network_partitions.set(graph['partitions'])
+  network_isolated_nodes.set(graph['isolated_nodes'])
+  network_largest_component_fraction.set(graph['largest_component_fraction'])
+  network_diameter_estimate.set(graph['diameter_estimate'])
+  network_articulation_points.set(len(graph['articulation_points']))
+  network_peer_degree.clear()
+  for percentile, degree in graph['degree_percentiles']:
+    network_peer_degree.labels(quantile=str(percentile / 100)).set(degree)
+
+  instrumentation.observe('compute', time.time() - end)
 
   nodes_synced_near_best_tip.set(synced_near_best_tip_fraction)
 
 # ========================================================================
 
-def collect_node_status(v1, namespace, seeds, pods, seed_nodes_responded, seed_nodes_queried):
-  peer_table = {}
-  error_resps = []
-  all_resps = []
+def collect_node_status(v1, namespace, seeds, inventory, seed_nodes_responded, seed_nodes_queried, index=None):
+  # each response is reduced to a compact record as soon as it is parsed, so the raw responses are never all held at once
+  table = peer_table.PeerTable(index)
   peer_set = set()
 
-  start = time.time()
+  # runs on a worker thread, adds the seed's responses to the table as they are parsed and returns its peers and how many valid responses it got.
+  # the responses are staged until the seed's query has succeeded, so a seed that fails part way through is left out entirely, as it always was
+  def query_seed(seed):
+    seed_daemon_port = pod_inventory.daemon_client_port(inventory.get(seed))
 
-  def contains_error(resp):
-    try:
-      resp['error']
-      return True
-    except KeyError :
-      return False
+    cmd = "mina advanced get-peers"
+    peers = util.exec_on_pod(v1, namespace, seed, 'coda', cmd).rstrip().split('\n')
 
-  def no_error(resp):
-    return (not (contains_error(resp)))
+    cmd = "mina advanced node-status -daemon-port " + seed_daemon_port + " -peers " + ",".join(peers) + " -show-errors"
 
-  def add_resp(raw, peers, seed, seed_node_responded, seed_node_queried):
-    resps = [ ast.literal_eval(s) for s in raw.split('\n') if s != '' ]
-    
-    valid_resps = list(filter(no_error, resps))
-    error_resps.extend(list(filter(contains_error, resps)))
-    all_resps.extend(resps)
-    peer_set.update(set(peers))
+    daemon_unreachable = []
 
-    seed_node_responded.labels(seed= seed).set(len(valid_resps))
-    seed_node_queried.labels(seed= seed).set(len(peers))
+    def resp_lines():
+      for s in util.exec_on_pod_lines(v1, namespace, seed, 'coda', cmd):
+        if 'Error: Unable to connect to Mina Daemon.' in s:
+          daemon_unreachable.append(s)
+          return
+        yield s
 
-    peer_resp_map = [ ((r['node_ip_addr'], r['node_peer_id']), r) for r in valid_resps ]
+    # lines are parsed as they arrive from the pod
+    staged = table.staging()
+    valid_count = 0
+    for resp in node_status.decode_node_statuses(resp_lines(), peer_table.fields):
+      valid_count += staged.add(resp)
 
-    for (p, r) in peer_resp_map:
-      if p not in peer_table:
-        peer_table[p] = r
+    if len(daemon_unreachable) > 0:
+      print("seed {} could not connect to its daemon".format(seed))
+      return None
 
-  for seed in seeds:
-    seed_pod = [ p for p in pods.to_dict()['items'] if p['metadata']['name'] == seed ][0]
-    seed_daemon_container = [ c for c in seed_pod['spec']['containers'] if c['args'][0] == 'daemon' ][0]
-    seed_vars_dict = [ v for v in seed_daemon_container['env'] ]
-    seed_daemon_port = [ v['value'] for v in seed_vars_dict if v['name'] == 'DAEMON_CLIENT_PORT'][0]
+    table.merge(staged)
 
-    try:
-      cmd = "mina advanced get-peers"
-      peers = util.exec_on_pod(v1, namespace, seed, 'coda', cmd).rstrip().split('\n')
+    return (peers, valid_count)
 
-      cmd = "mina advanced node-status -daemon-port " + seed_daemon_port + " -peers " + ",".join(peers) + " -show-errors"
-      resp = util.exec_on_pod(v1, namespace, seed, 'coda', cmd)
+  # caps the number of seeds queried at once so we don't overload the api server
+  seed_concurrency = int(os.environ.get('NODE_STATUS_SEED_CONCURRENCY', 4))
 
-      if not 'Error: Unable to connect to Mina Daemon.' in resp:
-        add_resp(resp, peers, seed, seed_nodes_responded, seed_nodes_queried)
-    except Exception as e:
-      print("failed to exec command on pod: {}".format(e))
-      continue
-      
+  with concurrent.futures.ThreadPoolExecutor(max_workers=seed_concurrency) as executor:
+    futures = { executor.submit(instrumentation.wrap(query_seed), seed): seed for seed in seeds }
 
-  valid_resps = peer_table.values()
-  end = time.time()
-  print("Node status collection took {} seconds".format(end-start))
+    for future in concurrent.futures.as_completed(futures):
+      seed = futures[future]
+      try:
+        result = future.result()
+      except Exception as e:
+        print("failed to exec command on pod {}: {}".format(seed, e))
+        continue
+
+      if result is not None:
+        peers, valid_count = result
+        peer_set.update(peers)
+        seed_nodes_responded.labels(seed=seed).set(valid_count)
+        seed_nodes_queried.labels(seed=seed).set(len(peers))
 
-  return (len(peer_set), valid_resps, error_resps)
+  return (len(peer_set), table)
 
 # ========================================================================
\ No newline at end of file
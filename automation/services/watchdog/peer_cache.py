@@ -0,0 +1,80 @@
+import json
+import os
+import time
+
+# ========================================================================
+
+# the peer id at the end of a multiaddr, e.g. /ip4/1.2.3.4/tcp/10909/p2p/12D3KooW...
+def multiaddr_peer_id(multiaddr):
+  return multiaddr.rstrip('/').split('/')[-1]
+
+# the timestamps are most of a response and nothing reads them, so only the hashes are kept
+def compact(resp):
+  if 'k_block_hashes_and_timestamps' not in resp:
+    return resp
+  resp = dict(resp)
+  resp['k_block_hashes'] = [ a[0] for a in resp.pop('k_block_hashes_and_timestamps') ]
+  return resp
+
+# writes to a temporary file next to path and renames it over path, so an interrupted write leaves the old file in place
+def write_json_atomically(path, obj):
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(obj, f)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, path)
+
+# the last valid node status response of each peer (by peer id) and when it was fetched, kept between make_report runs so an incremental
+# crawl only has to query the peers that are new or whose response is older than max_age_seconds
+class PeerCache:
+
+  def __init__(self, path, max_age_seconds=60*60, retention_seconds=24*60*60):
+    self.path = path
+    self.max_age_seconds = max_age_seconds
+    self.retention_seconds = retention_seconds
+    # peer id -> { 'fetched_at': ..., 'resp': ... }
+    self.entries = {}
+
+  def load(self):
+    if os.path.exists(self.path):
+      with open(self.path, 'r') as f:
+        self.entries = json.load(f)
+    return self
+
+  def save(self):
+    now = time.time()
+    self.entries = { p: e for p, e in self.entries.items() if now - e['fetched_at'] <= self.retention_seconds }
+    write_json_atomically(self.path, self.entries)
+
+  def update(self, resps, fetched_at=None):
+    fetched_at = fetched_at or time.time()
+    for resp in resps:
+      if 'error' in resp:
+        continue
+      resp = compact(resp)
+      self.entries[resp['node_peer_id']] = { 'fetched_at': fetched_at, 'resp': resp }
+
+  def fresh(self, peer_id):
+    entry = self.entries.get(peer_id)
+    return entry is not None and time.time() - entry['fetched_at'] <= self.max_age_seconds
+
+  # the cached response with its uptime brought up to date
+  def get(self, peer_id):
+    entry = self.entries[peer_id]
+    resp = dict(entry['resp'])
+    if 'uptime_minutes' in resp:
+      resp['uptime_minutes'] = int(resp['uptime_minutes']) + int((time.time() - entry['fetched_at']) / 60)
+    return resp
+
+  # splits a seed's current peers (multiaddrs) into the cached responses that are still fresh and the peers that need querying
+  def split(self, multiaddrs):
+    cached = []
+    stale = []
+    for multiaddr in multiaddrs:
+      peer_id = multiaddr_peer_id(multiaddr)
+      if self.fresh(peer_id):
+        cached.append(self.get(peer_id))
+      else:
+        stale.append(multiaddr)
+    return cached, stale
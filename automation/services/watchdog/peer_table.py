@@ -0,0 +1,88 @@
+import array
+import threading
+
+import block_index
+
+# ========================================================================
+
+# the parts of a node status response the watchdog's node status collector needs, the rest is dropped by the parse workers
+fields = [
+  'node_peer_id',
+  'node_ip_addr',
+  'sync_status',
+  'protocol_state_hash',
+  'k_block_hashes_and_timestamps',
+  'peers',
+  'error',
+]
+
+# what's kept of a node status response: the state hashes of its chain are interned into the table's block index, and the chain is a compact array of their ids (most recent last).
+# the peer ids of its peers are interned into the table, for the topology
+class PeerRecord:
+  __slots__ = [ 'peer_id', 'ip_addr', 'sync_status', 'protocol_state_hash', 'chain', 'peers' ]
+
+  def __init__(self, peer_id, ip_addr, sync_status, protocol_state_hash, chain, peers):
+    self.peer_id = peer_id
+    self.ip_addr = ip_addr
+    self.sync_status = sync_status
+    self.protocol_state_hash = protocol_state_hash
+    self.chain = chain
+    self.peers = peers
+
+  def key(self):
+    return (self.ip_addr, self.peer_id)
+
+# the responses from every seed, deduplicated by (ip, peer id) as they arrive so each response can be dropped as soon as it is added.
+# responses are added from the seed query threads. the ids can be shared with a fork tree by passing in its block index
+class PeerTable:
+
+  def __init__(self, index=None):
+    self._lock = threading.Lock()
+    self.index = index if index is not None else block_index.BlockIndex()
+    self.records = {}
+    # peer id -> dense id
+    self.peer_ids = {}
+    # error responses are small (they have no chain) and are kept whole for the error classifier
+    self.error_resps = []
+
+  # returns whether resp was a valid (non error) response
+  def add(self, resp):
+    with self._lock:
+      if 'error' in resp:
+        self.error_resps.append(resp)
+        return False
+
+      key = (resp['node_ip_addr'], resp['node_peer_id'])
+      if key not in self.records:
+        chain = array.array('I', [ self.index.intern(state_hash) for state_hash, _ in resp['k_block_hashes_and_timestamps'] ])
+        peers = array.array('I', [ self.peer_ids.setdefault(peer['peer_id'], len(self.peer_ids)) for peer in resp.get('peers', []) ])
+        self.records[key] = PeerRecord(resp['node_peer_id'], resp['node_ip_addr'], resp['sync_status'], resp['protocol_state_hash'], chain, peers)
+      return True
+
+  # a table for one seed's responses, added to this one with merge() only once the seed's query succeeds, so a seed that fails part way through
+  # leaves nothing behind. it shares this table's ids (and lock, for the interning)
+  def staging(self):
+    staged = PeerTable(self.index)
+    staged._lock = self._lock
+    staged.peer_ids = self.peer_ids
+    return staged
+
+  def merge(self, staged):
+    with self._lock:
+      for key, record in staged.records.items():
+        self.records.setdefault(key, record)
+      self.error_resps.extend(staged.error_resps)
+
+  def __len__(self):
+    return len(self.records)
+
+  def peers(self):
+    return self.records.values()
+
+  # (peer id, peer ids of its peers) of every record, as the dense ids, for topology.build
+  def peer_lists(self):
+    with self._lock:
+      return [ (self.peer_ids.setdefault(p.peer_id, len(self.peer_ids)), p.peers) for p in self.records.values() ]
+
+  def chain_hashes(self, record):
+    return [ self.index.hash(i) for i in record.chain ]
@@ -0,0 +1,164 @@
+import threading
+import time
+import traceback
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+import instrumentation
+import replay
+
+# ========================================================================
+
+# pods are matched to a role by name first (like the collectors always have), then by the labels set in the helm charts
+roles = [ 'seed', 'whale', 'fish', 'coordinator', 'archive' ]
+
+role_labels = {
+  'seed': 'seed',
+  'snark-coordinator': 'coordinator',
+  'archive-node': 'archive',
+}
+
+def pod_role(pod):
+  name = pod.metadata.name
+  for role in roles:
+    if role in name:
+      return role
+
+  labels = pod.metadata.labels or {}
+  role = labels.get('role')
+  if role == 'block-producer':
+    # block producers are told apart by their class (whale / fish)
+    return labels.get('class')
+  return role_labels.get(role, role)
+
+def daemon_client_port(pod):
+  daemon_container = [ c for c in pod.spec.containers if c.args and c.args[0] == 'daemon' ][0]
+  return [ v.value for v in daemon_container.env if v.name == 'DAEMON_CLIENT_PORT' ][0]
+
+# ========================================================================
+
+# an in-memory, indexed view of the pods in a namespace, kept up to date by a single kubernetes watch (like an informer) so collectors don't each have to list every pod
+class PodInventory:
+
+  def __init__(self, v1, namespace):
+    self.v1 = v1
+    self.namespace = namespace
+    self._lock = threading.Lock()
+    self._pods = {}
+    self._by_role = {}
+    self._by_container = {}
+    self._resource_version = None
+    self._listeners = []
+
+  # fn(event_type, pod) is called from the watch thread for every pod event, and with ADDED for every pod on a (re)list. a relist also calls it
+  # with DELETED for the pods that went away (or were replaced by a pod of the same name) since the last list or event
+  def add_listener(self, fn):
+    self._listeners.append(fn)
+
+  def _notify(self, event_type, pod):
+    for fn in self._listeners:
+      try:
+        fn(event_type, pod)
+      except Exception as e:
+        print(traceback.format_exc())
+
+  # lists the pods once and then keeps the inventory updated from a watch on a background thread
+  def start(self):
+    self.relist()
+    thread = threading.Thread(target=self._watch_forever, name='pod-inventory-' + self.namespace, daemon=True)
+    thread.start()
+    return self
+
+  def relist(self):
+    # relists happen on startup and on the watch thread, outside any collector, and are attributed to the inventory
+    with instrumentation.in_collector('pod_inventory', self.namespace), instrumentation.span('list_pods'):
+      pods = self.v1.list_namespaced_pod(self.namespace, watch=False)
+    replay.record_pods(pods)
+    current = { pod.metadata.name: pod.metadata.uid for pod in pods.items }
+    with self._lock:
+      vanished = [ pod for name, pod in self._pods.items() if current.get(name) != pod.metadata.uid ]
+      self._pods = {}
+      self._by_role = {}
+      self._by_container = {}
+      for pod in pods.items:
+        self._add(pod)
+      self._resource_version = pods.metadata.resource_version
+    # the watch that would have reported these has expired
+    for pod in vanished:
+      self._notify('DELETED', pod)
+    for pod in pods.items:
+      self._notify('ADDED', pod)
+    return self
+
+  def _add(self, pod):
+    name = pod.metadata.name
+    self._pods[name] = pod
+    self._by_role.setdefault(pod_role(pod), set()).add(name)
+    for c in pod.spec.containers:
+      self._by_container.setdefault(c.name, set()).add(name)
+
+  def _remove(self, name):
+    pod = self._pods.pop(name, None)
+    if pod is None:
+      return
+    self._by_role.get(pod_role(pod), set()).discard(name)
+    for c in pod.spec.containers:
+      self._by_container.get(c.name, set()).discard(name)
+
+  def _apply(self, event_type, pod):
+    with self._lock:
+      self._remove(pod.metadata.name)
+      if event_type != 'DELETED':
+        self._add(pod)
+      self._resource_version = pod.metadata.resource_version
+    self._notify(event_type, pod)
+
+  def _watch_forever(self):
+    while True:
+      try:
+        if self._resource_version is None:
+          self.relist()
+        w = watch.Watch()
+        for event in w.stream(self.v1.list_namespaced_pod, self.namespace, resource_version=self._resource_version, timeout_seconds=300):
+          if event['type'] == 'ERROR':
+            # most likely our resource version is too old, start again from a fresh list
+            print('pod watch error, relisting: {}'.format(event['raw_object']))
+            self._resource_version = None
+            break
+          if event['type'] in [ 'ADDED', 'MODIFIED', 'DELETED' ]:
+            self._apply(event['type'], event['object'])
+      except ApiException as e:
+        if e.status != 410:
+          print(traceback.format_exc())
+          time.sleep(5)
+        self._resource_version = None
+      except Exception as e:
+        print(traceback.format_exc())
+        time.sleep(5)
+        self._resource_version = None
+
+  # ========================================================================
+
+  def get(self, name):
+    with self._lock:
+      return self._pods.get(name)
+
+  def pods(self, role=None, container=None, running=False):
+    with self._lock:
+      if role is not None:
+        names = self._by_role.get(role, set())
+      elif container is not None:
+        names = self._by_container.get(container, set())
+      else:
+        names = self._pods.keys()
+      if role is not None and container is not None:
+        names = names.intersection(self._by_container.get(container, set()))
+      pods = [ self._pods[name] for name in sorted(names) ]
+
+    if running:
+      pods = [ p for p in pods if p.status.phase == 'Running' ]
+    return pods
+
+  def pod_names(self, role=None, container=None, running=False):
+    return [ p.metadata.name for p in self.pods(role=role, container=container, running=running) ]
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# record what the watchdog sees from a live cluster and replay it through the node status collector offline.
+#
+# recording: run the watchdog (or make_report) with NODE_STATUS_RECORD_DIR=<dir>, the pod list and the output of every command run on a pod are written there
+# replaying: python3 replay.py <dir>
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from kubernetes import client
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest
+
+# ========================================================================
+
+record_dir = os.environ.get('NODE_STATUS_RECORD_DIR')
+record_lock = threading.Lock()
+
+def exec_file_name(pod, container, command):
+  return '{}.{}.{}.txt'.format(pod, container, hashlib.sha1(command.encode('utf-8')).hexdigest()[:16])
+
+# wraps the text chunks of a command's output, writing them to the record dir as they pass through
+def record_exec(pod, container, command, chunks):
+  if record_dir is None:
+    yield from chunks
+    return
+
+  os.makedirs(os.path.join(record_dir, 'exec'), exist_ok=True)
+  fname = exec_file_name(pod, container, command)
+  with open(os.path.join(record_dir, 'exec', fname), 'w') as f:
+    for text in chunks:
+      f.write(text)
+      yield text
+
+  with record_lock:
+    with open(os.path.join(record_dir, 'exec_index.jsonl'), 'a') as f:
+      f.write(json.dumps({ 'pod': pod, 'container': container, 'command': command, 'file': fname }) + '\n')
+
+def record_pods(pods):
+  if record_dir is None:
+    return
+  os.makedirs(record_dir, exist_ok=True)
+  with open(os.path.join(record_dir, 'pods.json'), 'w') as f:
+    json.dump(client.ApiClient().sanitize_for_serialization(pods), f)
+
+# ========================================================================
+
+# stands in for client.CoreV1Api, serving the recorded pod list and command output
+class FakeCoreV1Api:
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.exec_files = {}
+    with open(os.path.join(directory, 'exec_index.jsonl')) as f:
+      for line in f:
+        entry = json.loads(line)
+        self.exec_files[(entry['pod'], entry['container'], entry['command'])] = entry['file']
+
+  def list_namespaced_pod(self, namespace, watch=False):
+    with open(os.path.join(self.directory, 'pods.json')) as f:
+      data = json.load(f)
+    # the same deserialization the client applies to an api response, without needing one
+    return client.ApiClient()._ApiClient__deserialize(data, 'V1PodList')
+
+  # util.stream_exec_on_pod hands commands to this instead of running them on a pod
+  def replay_exec(self, pod, container, command):
+    fname = self.exec_files.get((pod, container, command))
+    if fname is None:
+      raise Exception('no recorded output for {} on {}/{}'.format(command, pod, container))
+    with open(os.path.join(self.directory, 'exec', fname)) as f:
+      while True:
+        text = f.read(1 << 20)
+        if text == '':
+          return
+        yield text
+
+# ========================================================================
+
+def main():
+  parser = argparse.ArgumentParser(description="Replay recorded node status data through collect_node_status_metrics and print the resulting metrics")
+  parser.add_argument("directory", help="directory recorded with NODE_STATUS_RECORD_DIR", type=str)
+  parser.add_argument("-n", "--namespace", help="namespace the recording was made in", required=False, default='replay', type=str)
+  args = parser.parse_args(sys.argv[1:])
+
+  import pod_inventory
+  import fork_tree
+  import node_status_metrics
+
+  v1 = FakeCoreV1Api(args.directory)
+  inventory = pod_inventory.PodInventory(v1, args.namespace).relist()
+
+  registry = CollectorRegistry()
+  gauge = lambda name, labels=[]: Gauge('Coda_watchdog_' + name, name, labels, registry=registry)
+
+  node_status_metrics.collect_node_status_metrics(v1, args.namespace, inventory, fork_tree.ForkTree(),
+    gauge('nodes_synced_near_best_tip'), gauge('nodes_synced'), gauge('nodes_queried'), gauge('nodes_responded'),
+    gauge('nodes_queried_by_seed', ['seed']), gauge('nodes_responded_to_seed', ['seed']), gauge('node_status_errors'),
+    gauge('deadline_exceeded'), gauge('failed_negotiation'), gauge('connection_refused'), gauge('size_limit_exceeded'),
+    gauge('timed_out'), gauge('stream_reset'), gauge('node_status_other_errors'),
+    Counter('Coda_watchdog_prover_errors', 'prover_errors', registry=registry),
+    Counter('Coda_watchdog_node_status_error_responses', 'node_status_error_responses', ['category', 'subnet'], registry=registry),
+    gauge('nodes_by_blocks_behind_best_tip', ['blocks_behind']), gauge('network_partitions'), gauge('network_isolated_nodes'), gauge('network_largest_component_fraction'),
+    gauge('network_diameter_estimate'), gauge('network_articulation_points'), gauge('network_peer_degree', ['quantile']))
+
+  print(generate_latest(registry).decode('utf-8'))
+
+if __name__ == "__main__":
+  main()
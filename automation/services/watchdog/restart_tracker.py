@@ -0,0 +1,110 @@
+import collections
+import threading
+import time
+
+import pod_inventory
+
+# ========================================================================
+
+mina_containers = [ 'coda', 'seed', 'coordinator', 'archive' ]
+
+RestartEvent = collections.namedtuple('RestartEvent', [ 'time', 'role', 'exit_code', 'reason' ])
+
+# follows pod events from the pod inventory's watch and records every container restart as it happens, so crash loops that start and
+# recover between two collector runs are still seen. each container keeps a ring buffer of its most recent restarts
+class RestartTracker:
+
+  def __init__(self, container_restarts, history=32, window_seconds=60*60, crash_loop_restarts=3):
+    self.container_restarts = container_restarts
+    self.history = history
+    self.window_seconds = window_seconds
+    self.crash_loop_restarts = crash_loop_restarts
+    self._lock = threading.Lock()
+    # (pod, container) -> last seen restart count
+    self.restart_counts = {}
+    # (pod, container) -> deque of RestartEvent
+    self.events = {}
+    # (pod, container) -> role, for containers that are currently in CrashLoopBackOff
+    self.backing_off = {}
+    # (pod, container) -> role, for every container we're following
+    self.roles = {}
+
+  # a pod inventory listener
+  def observe(self, event_type, pod):
+    role = pod_inventory.pod_role(pod) or 'unknown'
+    statuses = [ c for c in (pod.status.container_statuses or []) if c.name in mina_containers ]
+
+    with self._lock:
+      if event_type == 'DELETED':
+        for c in statuses:
+          key = (pod.metadata.name, c.name)
+          self.restart_counts.pop(key, None)
+          self.backing_off.pop(key, None)
+          self.roles.pop(key, None)
+        return
+
+      for c in statuses:
+        key = (pod.metadata.name, c.name)
+        self.roles[key] = role
+
+        waiting = c.state.waiting if c.state is not None else None
+        if waiting is not None and waiting.reason == 'CrashLoopBackOff':
+          self.backing_off[key] = role
+        else:
+          self.backing_off.pop(key, None)
+
+        previous = self.restart_counts.get(key)
+        self.restart_counts[key] = c.restart_count
+        # restarts from before we started watching aren't counted, we don't know when they happened
+        if previous is None or c.restart_count <= previous:
+          continue
+
+        terminated = c.last_state.terminated if c.last_state is not None else None
+        if terminated is not None:
+          finished_at = terminated.finished_at.timestamp() if terminated.finished_at is not None else time.time()
+          event = RestartEvent(finished_at, role, terminated.exit_code, terminated.reason or 'unknown')
+        else:
+          event = RestartEvent(time.time(), role, None, 'unknown')
+
+        new_restarts = c.restart_count - previous
+        ring = self.events.setdefault(key, collections.deque(maxlen=self.history))
+        for _ in range(min(new_restarts, self.history)):
+          ring.append(event)
+        self.container_restarts.labels(role=role, reason=event.reason).inc(new_restarts)
+
+  # ========================================================================
+
+  # the (pod, container)s that restarted within the last seconds
+  def restarted_within(self, seconds):
+    now = time.time()
+    with self._lock:
+      return set(key for key, ring in self.events.items() if any(now - e.time <= seconds for e in ring))
+
+  # per role: restarts per hour, mean time between failures (seconds of container uptime per restart) and the number of crash looping containers, over the window
+  def stats(self):
+    now = time.time()
+    restarts = collections.Counter()
+    containers = collections.Counter()
+    crash_looping = collections.Counter()
+
+    with self._lock:
+      for key, ring in list(self.events.items()):
+        recent = [ e for e in ring if now - e.time <= self.window_seconds ]
+        if len(recent) == 0 and key not in self.roles:
+          # the pod is gone and its restarts are too old to matter
+          del self.events[key]
+          continue
+        role = self.roles.get(key, recent[-1].role if len(recent) > 0 else 'unknown')
+        restarts[role] += len(recent)
+        if len(recent) >= self.crash_loop_restarts and key not in self.backing_off:
+          crash_looping[role] += 1
+
+      for key, role in self.roles.items():
+        containers[role] += 1
+      for key, role in self.backing_off.items():
+        crash_looping[role] += 1
+
+    roles = set(containers) | set(restarts)
+    restarts_per_hour = { r: restarts[r] * 3600 / self.window_seconds for r in roles }
+    mtbf = { r: containers[r] * self.window_seconds / restarts[r] for r in roles if restarts[r] > 0 }
+    return restarts_per_hour, mtbf, { r: crash_looping[r] for r in roles }
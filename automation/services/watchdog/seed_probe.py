@@ -0,0 +1,76 @@
+import collections
+import concurrent.futures
+import json
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+# ========================================================================
+
+ProbeResult = collections.namedtuple('ProbeResult', [ 'time', 'up', 'latency' ])
+
+latency_quantiles = [ 0.5, 0.9, 0.99 ]
+
+# dials each seed with its own check_libp2p process, concurrently and with a timeout per seed, and keeps the last few results for each seed.
+# the latency is the time taken by the check_libp2p process, i.e. the dial plus starting up a libp2p host
+class SeedProber:
+
+  def __init__(self, history=24, timeout_seconds=30, concurrency=8, binary='check_libp2p/check_libp2p'):
+    self.timeout_seconds = timeout_seconds
+    self.concurrency = concurrency
+    self.binary = binary
+    self.history_size = history
+    # fetched once by the caller and kept until no seed can be reached with it
+    self.chain_id = None
+    self._lock = threading.Lock()
+    self.history = {}
+
+  def probe_seed(self, seed):
+    start = time.time()
+    try:
+      # communicate (via run) reads stdout and stderr together, so neither pipe can fill up and block the process
+      proc = subprocess.run([ self.binary, self.chain_id, seed ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=self.timeout_seconds)
+      latency = time.time() - start
+      if proc.stderr.strip() != '':
+        print("check_libp2p error for {}: {}".format(seed, proc.stderr.strip()))
+      up = all(json.loads(proc.stdout).values()) if proc.returncode == 0 else False
+    except subprocess.TimeoutExpired:
+      print("check_libp2p timed out for {}".format(seed))
+      latency = time.time() - start
+      up = False
+    except ValueError as e:
+      print("unexpected check_libp2p output for {}: {}".format(seed, e))
+      latency = time.time() - start
+      up = False
+    return ProbeResult(start, up, latency)
+
+  # returns the result for each seed
+  def probe(self, seeds):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+      results = dict(zip(seeds, executor.map(self.probe_seed, seeds)))
+
+    with self._lock:
+      for seed, result in results.items():
+        self.history.setdefault(seed, collections.deque(maxlen=self.history_size)).append(result)
+      # seeds that were dropped from the seed list
+      for seed in [ s for s in self.history if s not in results ]:
+        del self.history[seed]
+
+    if len(results) > 0 and not any(r.up for r in results.values()):
+      # the network may have been redeployed with a new chain id
+      self.chain_id = None
+
+    return results
+
+  # fraction of probes that succeeded, per seed
+  def availability(self):
+    with self._lock:
+      return { seed: sum(r.up for r in h) / len(h) for seed, h in self.history.items() }
+
+  # latency quantiles of the successful probes, per seed
+  def latency_percentiles(self):
+    with self._lock:
+      latencies = { seed: [ r.latency for r in h if r.up ] for seed, h in self.history.items() }
+    return { seed: dict(zip(latency_quantiles, np.quantile(ls, latency_quantiles))) for seed, ls in latencies.items() if len(ls) > 0 }
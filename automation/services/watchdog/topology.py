@@ -0,0 +1,124 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+# ========================================================================
+
+degree_percentiles = [ 0, 5, 25, 50, 95, 100 ]
+
+# the peer graph of the nodes that responded to node status queries: an undirected sparse adjacency matrix over their peer ids, with an edge
+# wherever either of two responding nodes lists the other as a peer. the peers that didn't respond are left out, they would only hang off the
+# graph as leaves (and make every node they hang off an articulation point)
+#
+# peer_lists is an iterable of (peer id, [ peer ids of its peers ]), the ids can be anything hashable
+def build(peer_lists):
+  peer_lists = list(peer_lists)
+  ids = {}
+  for peer_id, _ in peer_lists:
+    ids.setdefault(peer_id, len(ids))
+
+  rows = []
+  cols = []
+  for peer_id, neighbors in peer_lists:
+    node = ids[peer_id]
+    for neighbor in neighbors:
+      other = ids.get(neighbor)
+      if other is not None and other != node:
+        rows.append(node)
+        cols.append(other)
+
+  n = len(ids)
+  rows = np.array(rows, dtype=np.int32)
+  cols = np.array(cols, dtype=np.int32)
+  adjacency = scipy.sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)).tocsr()
+  # symmetric, and the duplicates (an edge listed from both ends) summed into one entry are set back to 1
+  adjacency = (adjacency + adjacency.T).tocsr()
+  adjacency.data[:] = 1
+  return list(ids), adjacency
+
+# a lower bound on the diameter of the component containing start, from two breadth first searches: the eccentricity of the node farthest from
+# start. exact on trees and usually close on sparse graphs like this one
+def diameter_estimate(adjacency, start):
+  distances = scipy.sparse.csgraph.shortest_path(adjacency, unweighted=True, indices=start)
+  far = int(np.argmax(np.where(np.isinf(distances), -1, distances)))
+  distances = scipy.sparse.csgraph.shortest_path(adjacency, unweighted=True, indices=far)
+  return int(distances[np.isfinite(distances)].max())
+
+# the nodes whose removal disconnects their component, by tarjan's lowpoint algorithm with an explicit stack (over the csr arrays) so large
+# components don't hit the recursion limit
+def articulation_points(adjacency):
+  # plain lists, indexing numpy arrays one element at a time is much slower
+  indptr = adjacency.indptr.tolist()
+  indices = adjacency.indices.tolist()
+  n = adjacency.shape[0]
+
+  discovery = [ -1 ]*n
+  low = [ 0 ]*n
+  parent = [ -1 ]*n
+  # the next neighbor of each node to look at
+  next_edge = indptr[:-1]
+  is_articulation = np.zeros(n, dtype=bool)
+  time = 0
+
+  for root in range(n):
+    if discovery[root] >= 0:
+      continue
+    discovery[root] = low[root] = time
+    time += 1
+    root_children = 0
+    stack = [ root ]
+    while len(stack) > 0:
+      node = stack[-1]
+      if next_edge[node] < indptr[node + 1]:
+        neighbor = indices[next_edge[node]]
+        next_edge[node] += 1
+        if discovery[neighbor] < 0:
+          parent[neighbor] = node
+          discovery[neighbor] = low[neighbor] = time
+          time += 1
+          if node == root:
+            root_children += 1
+          stack.append(neighbor)
+        elif neighbor != parent[node]:
+          low[node] = min(low[node], discovery[neighbor])
+        continue
+
+      stack.pop()
+      up = parent[node]
+      if up >= 0:
+        low[up] = min(low[up], low[node])
+        if up != root and low[node] >= discovery[up]:
+          is_articulation[up] = True
+    is_articulation[root] = root_children > 1
+
+  return np.nonzero(is_articulation)[0]
+
+# connectivity, a diameter estimate, the degree distribution and the articulation points of the graph from build.
+#
+# a responding node none of whose peers responded (common behind NAT, or when its peers are overloaded) is a component of its own, so the
+# component count goes up on nearly every crawl. those are counted as isolated_nodes, and partitions only counts the components with at least
+# min_partition_size nodes and min_partition_fraction of all of them: more than one partition means the network really is split
+def analyze(ids, adjacency, min_partition_size=3, min_partition_fraction=0.05):
+  n = len(ids)
+  if n == 0:
+    return { 'nodes': 0, 'edges': 0, 'components': 0, 'partitions': 0, 'isolated_nodes': 0, 'largest_component': 0, 'largest_component_fraction': 0,
+             'diameter_estimate': 0, 'degree_percentiles': [], 'articulation_points': [] }
+
+  components, labels = scipy.sparse.csgraph.connected_components(adjacency, directed=False)
+  sizes = np.bincount(labels)
+  largest = int(np.argmax(sizes))
+  degrees = np.diff(adjacency.indptr)
+
+  return {
+    'nodes': n,
+    'edges': int(adjacency.nnz // 2),
+    'components': int(components),
+    'partitions': int((sizes >= max(min_partition_size, min_partition_fraction*n)).sum()),
+    'isolated_nodes': int((sizes == 1).sum()),
+    'largest_component': int(sizes[largest]),
+    'largest_component_fraction': float(sizes[largest] / n),
+    # the search starts from the best connected node of the largest component
+    'diameter_estimate': diameter_estimate(adjacency, int(np.argmax(np.where(labels == largest, degrees, -1)))),
+    'degree_percentiles': list(zip(degree_percentiles, np.percentile(degrees, degree_percentiles).tolist())),
+    'articulation_points': [ ids[i] for i in articulation_points(adjacency) ],
+  }
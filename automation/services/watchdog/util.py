@@ -4,9 +4,16 @@ from kubernetes import client, config, stream
 import sys
 import traceback
 import asyncio
+import random
 import uuid
 import time
-import math
+import base64
+import codecs
+import shlex
+import zlib
+
+import instrumentation
+import replay
 
 def get_kubernetes():
   if os.environ.get('LOCAL_KUBERNETES') is not None:
@@ -16,69 +23,179 @@ def get_kubernetes():
     config.load_incluster_config()
     with open('/var/run/secrets/kubernetes.io/serviceaccount/namespace', 'r') as f:
       namespace = f.read()
-  v1 = client.CoreV1Api()
+  # one client (and so one connection pool) is shared by every collector of every namespace, with enough connections for them to run at once
+  configuration = client.Configuration.get_default_copy()
+  configuration.connection_pool_maxsize = int(os.environ.get('KUBERNETES_CONNECTIONS', 32))
+  v1 = client.CoreV1Api(client.ApiClient(configuration))
   return v1, namespace
 
-async def run_periodically(fn, seconds_between, error_counter):
-  while True:
+# runs fn on the executor every seconds_between seconds so a slow collector can't block the event loop or starve the other collectors.
+# a run that is still going when the next one is due is skipped instead of stacked, and a run that takes longer than deadline_seconds is recorded as an overrun (threads can't be killed, so it is left to finish)
+async def run_periodically(name, fn, seconds_between, deadline_seconds, executor, error_counter, collector_duration, collector_overruns, collector_skipped_runs, max_jitter_seconds = 60, namespace = ''):
+  loop = asyncio.get_event_loop()
+  description = instrumentation.qualified_name(name, namespace)
+
+  async def run_once():
+    start = time.time()
+    future = loop.run_in_executor(executor, instrumentation.run_collector, name, fn, namespace)
     try:
-      fn()
+      try:
+        await asyncio.wait_for(asyncio.shield(future), deadline_seconds)
+      except asyncio.TimeoutError:
+        print('{} did not finish within its {} second deadline'.format(description, deadline_seconds))
+        try:
+          await future
+        finally:
+          collector_overruns.labels(collector=name).observe(time.time() - start - deadline_seconds)
     except Exception as e:
-      exc_type, exc_obj, exc_tb = sys.exc_info()
       trace = traceback.format_exc()
       error_counter.inc()
       print(trace)
+    collector_duration.labels(collector=name).observe(time.time() - start)
+
+  # spread out the collectors so they don't all hit the api server at once
+  await asyncio.sleep(random.uniform(0, max_jitter_seconds))
+
+  running = None
+  while True:
+    if running is not None and not running.done():
+      print('{} is still running from its last run, skipping'.format(description))
+      collector_skipped_runs.labels(collector=name).inc()
+    else:
+      running = asyncio.ensure_future(run_once())
 
     await asyncio.sleep(seconds_between)
 
 # ===============================================================
 
-# kubernetes has issues streaming big blobs over - this function runs a command, and then breaks the result up over multiple requests to ensure the result makes it over safely
-def exec_on_pod(v1, namespace, pod, container, command, request_timeout_seconds = 600):
-  def exec_cmd(command, timeout):
+# kubernetes has issues streaming big blobs over a single exec - this function runs the command in the background on the pod with its output gzipped into a tmp file, and streams that file back (base64 encoded) while it is still being written. If the stream breaks it reconnects and resumes from the last byte received, so each byte is only sent once.
+def stream_exec_on_pod_live(v1, namespace, pod, container, command, request_timeout_seconds = 600, max_resumes = 3):
+  def open_stream(script):
     exec_command = [
       '/bin/bash',
       '-c',
-      command,
+      script,
     ]
-    result = stream.stream(v1.connect_get_namespaced_pod_exec, pod, namespace, command=exec_command, container=container, stderr=True, stdout=True, stdin=False, tty=False, _request_timeout=timeout)
-    return result
+    return stream.stream(v1.connect_get_namespaced_pod_exec, pod, namespace, command=exec_command, container=container, stderr=True, stdout=True, stdin=False, tty=False, _preload_content=False, _request_timeout=request_timeout_seconds)
 
   print('running command:', command)
 
-  tmp_file = '/tmp/cns_command.' + str(uuid.uuid4()) + '.out'
-
-  start = time.time()
-  result = exec_cmd(command + ' &> ' + tmp_file, request_timeout_seconds)
-  end = time.time()
+  tmp_file = '/tmp/cns_command.' + str(uuid.uuid4())
+  out_file = tmp_file + '.out.gz'
+  pid_file = tmp_file + '.pid'
 
-  print('done running command')
-  print('\tseconds to run:', end - start)
+  cleanup = 'rm -f ' + out_file + ' ' + pid_file
+  run_in_background = shlex.quote('(' + command + ') 2>&1 | gzip -c >> ' + out_file)
+  # the files are only removed by finish, once the output is known to be complete or the command is given up on. a broken stream kills the tail
+  # pipeline, and anything chained after it would run and take the files a resume reads from with it
+  send_from = lambda offset, pid: 'tail -c +' + str(offset + 1) + ' -f --pid=' + pid + ' ' + out_file + ' | base64 -w 0'
 
-  file_len = int(exec_cmd('stat --printf="%s" ' + tmp_file, 10))
-  print('\tfile length:', str(file_len/(1024*1024)) + 'MB')
+  def finish(kill):
+    try:
+      # the pid is also the process group of the command and its gzip, so they're killed with it
+      ws = open_stream(('kill -- -$(cat ' + pid_file + ') 2> /dev/null; ' if kill else '') + cleanup)
+      ws.run_forever(timeout=10)
+      ws.close()
+    except Exception as e:
+      print('\tfailed to clean up', tmp_file, 'on', pod + ':', e)
 
+  # setsid starts the command in a process group of its own (the background job isn't a group leader, so setsid doesn't fork and $! is the
+  # group id), so that killing the group on giving up kills the command itself and not just the bash wrapper
+  script = ': > ' + out_file + '; nohup setsid bash -c ' + run_in_background + ' > /dev/null 2>&1 & echo $! > ' + pid_file + '; ' + send_from(0, '$!')
 
-  read_segment = lambda start, size: exec_cmd('cat ' + tmp_file + ' | head -c ' + str(start + size) + ' | tail -c ' + str(size), 240)
-  chunk_size = int(20e6)
-  read_chunk = lambda i: read_segment(i*chunk_size, min((i+1)*chunk_size, file_len) - i*chunk_size)
-  num_chunks = math.ceil(file_len/chunk_size)
+  # number of compressed bytes decoded so far, which is also the offset to resume from
+  received = 0
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  decoder = codecs.getincrementaldecoder('utf-8')('replace')
 
   start = time.time()
-  chunks = list(map(read_chunk, range(num_chunks)))
-  result = ''.join(chunks)
-  end = time.time()
-
-  print('\tseconds to get result:', end - start)
-
-  exec_cmd('rm ' + tmp_file, 10)
+  first_byte_at = None
+  deadline = start + request_timeout_seconds
+  resumes = 0
+
+  complete = False
+  try:
+    while True:
+      # base64 characters that don't make up a full 4 character group yet
+      pending = ''
+      succeeded = False
+      try:
+        ws = open_stream(script)
+        try:
+          while True:
+            if ws.peek_stdout():
+              pending += ws.read_stdout()
+              if first_byte_at is None:
+                first_byte_at = time.time()
+              usable = len(pending) - len(pending) % 4
+              compressed = base64.b64decode(pending[:usable])
+              pending = pending[usable:]
+              received += len(compressed)
+              text = decoder.decode(decompressor.decompress(compressed))
+              if text != '':
+                # the deadline is on the command and the transfer, the time the consumer spends with the output doesn't count against it
+                paused_at = time.time()
+                yield text
+                deadline += time.time() - paused_at
+            if ws.peek_stderr():
+              print('\tstderr:', ws.read_stderr())
+            if not ws.is_open():
+              break
+            if time.time() > deadline:
+              raise Exception('command did not finish within ' + str(request_timeout_seconds) + ' seconds: ' + command)
+            ws.update(timeout=1)
+          status = ws.read_channel(3)
+          succeeded = status != '' and json.loads(status).get('status') == 'Success'
+        finally:
+          ws.close()
+      except zlib.error:
+        raise
+      except Exception as e:
+        if time.time() > deadline:
+          raise
+        print('\tstream broken after', received, 'bytes:', e)
+
+      if succeeded and decompressor.eof:
+        break
+
+      if resumes >= max_resumes or time.time() > deadline:
+        raise Exception('failed to stream result of command after ' + str(resumes) + ' resumes: ' + command)
+
+      resumes += 1
+      print('\tresuming from byte', received)
+      script = send_from(received, '$(cat ' + pid_file + ')')
+    complete = True
+  finally:
+    # the command is killed if it is still running when its output is given up on
+    finish(kill=not complete)
+
+  tail = decoder.decode(b'', final=True)
+  if tail != '':
+    yield tail
 
-  received_len = len(result.encode('utf-8'))
-
-  if file_len != received_len:
-    print('\twarning, result length didn\'t match received length', file_len, received_len)
-
-  # seems to fail frequently
-  # assert(file_len - received_len == 0 or file_len - received_len == 1)
+  end = time.time()
+  first_byte_at = first_byte_at or end
+  # the command keeps running while its output is sent, so exec is the time until its first output arrived
+  instrumentation.observe('exec', first_byte_at - start)
+  instrumentation.observe('transfer', end - first_byte_at)
+  instrumentation.observe_exec_bytes(received)
+  print('\tcompressed bytes received:', str(received/(1024*1024)) + 'MB')
+
+# replays recorded output when v1 is a replay.FakeCoreV1Api, and records the output when NODE_STATUS_RECORD_DIR is set
+def stream_exec_on_pod(v1, namespace, pod, container, command, request_timeout_seconds = 600, max_resumes = 3):
+  if hasattr(v1, 'replay_exec'):
+    return v1.replay_exec(pod, container, command)
+  return replay.record_exec(pod, container, command, stream_exec_on_pod_live(v1, namespace, pod, container, command, request_timeout_seconds, max_resumes))
+
+# yields the command's output line by line (without the newline) while it is being received
+def exec_on_pod_lines(v1, namespace, pod, container, command, request_timeout_seconds = 600):
+  partial = ''
+  for text in stream_exec_on_pod(v1, namespace, pod, container, command, request_timeout_seconds):
+    lines = (partial + text).split('\n')
+    partial = lines.pop()
+    yield from lines
+  if partial != '':
+    yield partial
 
-  return result
+def exec_on_pod(v1, namespace, pod, container, command, request_timeout_seconds = 600):
+  return ''.join(stream_exec_on_pod(v1, namespace, pod, container, command, request_timeout_seconds))
@@ -1,5 +1,9 @@
 # Example of running locally
 # SEED_PEERS_URL=https://storage.googleapis.com/seed-lists/mainnet_seeds.txt LOCAL_KUBERNETES=true KUBERNETES_NAMESPACE=watchdog-test METRICS_PORT=8000 python3 watchdog.py
+#
+# to watch several testnets from one watchdog, set KUBERNETES_NAMESPACES=testnet-a,testnet-b (or KUBERNETES_NAMESPACE_SELECTOR=<label selector>),
+# every metric has a namespace label. each namespace's seed list is set with SEED_PEERS_URLS=testnet-a=<url>,testnet-b=<url>, seed_list_up is
+# skipped for a namespace without one
 
 from prometheus_client import start_http_server, Summary
 import time
@@ -7,8 +11,17 @@ import os
 import json
 from prometheus_client import Counter
 from prometheus_client import Gauge
+from prometheus_client import Histogram
 import asyncio
+import math
 import util
+import pod_inventory
+import fork_tree
+import block_bucket
+import restart_tracker
+import seed_probe
+import instrumentation
+import namespaces
 
 import metrics
 
@@ -19,48 +32,115 @@ def main():
 
   port = int(os.environ['METRICS_PORT'])
   start_http_server(port)
+  instrumentation.serve_profiles()
 
-  v1, namespace = util.get_kubernetes()
-
-  cluster_crashes = Gauge('Coda_watchdog_cluster_crashes', 'Description of gauge')
-  error_counter = Counter('Coda_watchdog_errors', 'Description of gauge')
-
-  nodes_synced_near_best_tip = Gauge('Coda_watchdog_nodes_synced_near_best_tip', 'Description of gauge')
-  nodes_synced = Gauge('Coda_watchdog_nodes_synced', 'Description of gauge')
-  nodes_responded = Gauge('Coda_watchdog_nodes_responded', 'Number of nodes that responded to the last status query')
-  prover_errors = Counter('Coda_watchdog_prover_errors', 'Description of gauge')
-  pods_with_no_new_logs = Gauge('Coda_watchdog_pods_with_no_new_logs', 'Number of nodes whose latest log is older than 10 minutes')
-  nodes_queried=Gauge('Coda_watchdog_nodes_queried', 'Number of nodes that were queried for node-status')
-  seed_nodes_responded=Gauge('Coda_watchdog_nodes_responded_to_seed', 'Number of nodes that responded to the last status query on each seed', ['seed'])
-  seed_nodes_queried=Gauge('Coda_watchdog_nodes_queried_by_seed', 'Number of nodes that were queried for node-status on each seed', ['seed'])
-  context_deadline_exceeded=Gauge('Coda_watchdog_deadline_exceeded', 'Number of nodes that failed with the context-deadline-exceeded error to a node-status query')
-  failed_security_protocol_negotiation=Gauge('Coda_watchdog_failed_negotiation', 'Number of nodes that failed with the security-protocol-negotiation error to a node-status query')
-  connection_refused_errors=Gauge('Coda_watchdog_connection_refused', 'Number of nodes that failed with the connection-refused error to a node-status query')
-  size_limit_exceeded_errors=Gauge('Coda_watchdog_size_limit_exceeded', 'Number of nodes that failed to a respond to a node-status query becuase of the data size')
-  timed_out_errors=Gauge('Coda_watchdog_timed_out', 'Number of nodes that failed with the time-out error to a node-status query')
-  stream_reset_errors=Gauge('Coda_watchdog_stream_reset', 'Number of nodes that failed with the stream-reset error to a node-status query')
-  other_connection_errors=Gauge('Coda_watchdog_node_status_other_errors', 'Number of nodes that failed with an unexpected error to respond to a node-status query(look for it in the logs)')
-  nodes_errored=Gauge('Coda_watchdog_node_status_errors', 'Number of nodes that failed to respond to a node-status query')
-
-  recent_google_bucket_blocks = Gauge('Coda_watchdog_recent_google_bucket_blocks', 'Description of gauge')
-  seeds_reachable = Gauge('Coda_watchdog_seeds_reachable', 'Description of gauge')
+  v1, default_namespace = util.get_kubernetes()
+  watched = namespaces.watched_namespaces(v1, default_namespace)
+  print('watching namespaces:', ', '.join(watched))
+
+  cluster_crashes = namespaces.metric(Gauge, 'Coda_watchdog_cluster_crashes', 'Description of gauge', ['namespace'])
+  restarts_per_hour = namespaces.metric(Gauge, 'Coda_watchdog_restarts_per_hour', 'Container restarts per hour over the last hour, by role', ['namespace', 'role'])
+  mean_time_between_failures = namespaces.metric(Gauge, 'Coda_watchdog_mean_time_between_failures', 'Seconds of container uptime per restart over the last hour, by role', ['namespace', 'role'])
+  crash_looping_containers = namespaces.metric(Gauge, 'Coda_watchdog_crash_looping_containers', 'Containers in CrashLoopBackOff or restarting repeatedly over the last hour, by role', ['namespace', 'role'])
+  container_restarts = namespaces.metric(Counter, 'Coda_watchdog_container_restarts', 'Container restarts seen by the pod watch', ['namespace', 'role', 'reason'])
+
+  error_counter = namespaces.metric(Counter, 'Coda_watchdog_errors', 'Description of gauge', ['namespace'])
+
+  nodes_synced_near_best_tip = namespaces.metric(Gauge, 'Coda_watchdog_nodes_synced_near_best_tip', 'Description of gauge', ['namespace'])
+  nodes_synced = namespaces.metric(Gauge, 'Coda_watchdog_nodes_synced', 'Description of gauge', ['namespace'])
+  nodes_responded = namespaces.metric(Gauge, 'Coda_watchdog_nodes_responded', 'Number of nodes that responded to the last status query', ['namespace'])
+  prover_errors = namespaces.metric(Counter, 'Coda_watchdog_prover_errors', 'Description of gauge', ['namespace'])
+  pods_with_no_new_logs = namespaces.metric(Gauge, 'Coda_watchdog_pods_with_no_new_logs', 'Number of nodes whose latest log is older than 10 minutes', ['namespace'])
+  pod_last_log_age = namespaces.metric(Gauge, 'Coda_watchdog_pod_last_log_age_seconds', 'Seconds since the last log line of each running mina pod', ['namespace', 'pod'])
+  nodes_queried=namespaces.metric(Gauge, 'Coda_watchdog_nodes_queried', 'Number of nodes that were queried for node-status', ['namespace'])
+  seed_nodes_responded=namespaces.metric(Gauge, 'Coda_watchdog_nodes_responded_to_seed', 'Number of nodes that responded to the last status query on each seed', ['namespace', 'seed'])
+  seed_nodes_queried=namespaces.metric(Gauge, 'Coda_watchdog_nodes_queried_by_seed', 'Number of nodes that were queried for node-status on each seed', ['namespace', 'seed'])
+  context_deadline_exceeded=namespaces.metric(Gauge, 'Coda_watchdog_deadline_exceeded', 'Number of nodes that failed with the context-deadline-exceeded error to a node-status query', ['namespace'])
+  failed_security_protocol_negotiation=namespaces.metric(Gauge, 'Coda_watchdog_failed_negotiation', 'Number of nodes that failed with the security-protocol-negotiation error to a node-status query', ['namespace'])
+  connection_refused_errors=namespaces.metric(Gauge, 'Coda_watchdog_connection_refused', 'Number of nodes that failed with the connection-refused error to a node-status query', ['namespace'])
+  size_limit_exceeded_errors=namespaces.metric(Gauge, 'Coda_watchdog_size_limit_exceeded', 'Number of nodes that failed to a respond to a node-status query becuase of the data size', ['namespace'])
+  timed_out_errors=namespaces.metric(Gauge, 'Coda_watchdog_timed_out', 'Number of nodes that failed with the time-out error to a node-status query', ['namespace'])
+  stream_reset_errors=namespaces.metric(Gauge, 'Coda_watchdog_stream_reset', 'Number of nodes that failed with the stream-reset error to a node-status query', ['namespace'])
+  other_connection_errors=namespaces.metric(Gauge, 'Coda_watchdog_node_status_other_errors', 'Number of nodes that failed with an unexpected error to respond to a node-status query(look for it in the logs)', ['namespace'])
+  nodes_errored=namespaces.metric(Gauge, 'Coda_watchdog_node_status_errors', 'Number of nodes that failed to respond to a node-status query', ['namespace'])
+  node_status_errors_by_category=namespaces.metric(Counter, 'Coda_watchdog_node_status_error_responses', 'Node-status query failures by error category and the /16 subnet of the peer that failed', ['namespace', 'category', 'subnet'])
+  nodes_by_blocks_behind=namespaces.metric(Gauge, 'Coda_watchdog_nodes_by_blocks_behind_best_tip', 'Number of synced nodes by how many blocks their tip is behind the most common best tip (negative when ahead, unknown when their chain does not meet it within a few blocks)', ['namespace', 'blocks_behind'])
+  network_partitions=namespaces.metric(Gauge, 'Coda_watchdog_network_partitions', 'Number of sizable connected components of the peer graph of the nodes that responded to node-status queries (more than one means the network is partitioned)', ['namespace'])
+  network_isolated_nodes=namespaces.metric(Gauge, 'Coda_watchdog_network_isolated_nodes', 'Number of responding nodes none of whose peers responded to node-status queries', ['namespace'])
+  network_largest_component_fraction=namespaces.metric(Gauge, 'Coda_watchdog_network_largest_component_fraction', 'Fraction of the responding nodes in the largest connected component of the peer graph', ['namespace'])
+  network_diameter_estimate=namespaces.metric(Gauge, 'Coda_watchdog_network_diameter_estimate', 'Estimate (a lower bound) of the diameter in hops of the largest component of the peer graph', ['namespace'])
+  network_articulation_points=namespaces.metric(Gauge, 'Coda_watchdog_network_articulation_points', 'Number of responding nodes whose loss would disconnect the peer graph', ['namespace'])
+  network_peer_degree=namespaces.metric(Gauge, 'Coda_watchdog_network_peer_degree', 'Percentiles of the number of responding peers each responding node is connected to', ['namespace', 'quantile'])
+
+  recent_google_bucket_blocks = namespaces.metric(Gauge, 'Coda_watchdog_recent_google_bucket_blocks', 'Description of gauge', ['namespace'])
+  google_bucket_upload_rate = namespaces.metric(Gauge, 'Coda_watchdog_google_bucket_upload_rate', 'Blocks uploaded to the google storage bucket per hour, over the last hour', ['namespace'])
+  google_bucket_max_upload_gap = namespaces.metric(Gauge, 'Coda_watchdog_google_bucket_max_upload_gap', 'Longest time in seconds without a block upload to the google storage bucket over the last hour', ['namespace'])
+  seeds_reachable = namespaces.metric(Gauge, 'Coda_watchdog_seeds_reachable', 'Description of gauge', ['namespace'])
+  seed_availability = namespaces.metric(Gauge, 'Coda_watchdog_seed_availability', 'Fraction of the recent dials to each seed that succeeded', ['namespace', 'seed'])
+  seed_dial_latency = namespaces.metric(Gauge, 'Coda_watchdog_seed_dial_latency_seconds', 'Percentiles of the time taken by recent successful dials to each seed', ['namespace', 'seed', 'quantile'])
 
   # ========================================================================
 
-  fns = [
-    ( lambda: metrics.collect_cluster_crashes(v1, namespace, cluster_crashes), 30*60 ),
-    ( lambda: metrics.collect_node_status_metrics(v1, namespace, nodes_synced_near_best_tip, nodes_synced, nodes_queried, nodes_responded, seed_nodes_queried, seed_nodes_responded, nodes_errored, context_deadline_exceeded, failed_security_protocol_negotiation, connection_refused_errors,size_limit_exceeded_errors, timed_out_errors, stream_reset_errors, other_connection_errors, prover_errors), 10*60 ),
-    ( lambda: metrics.check_seed_list_up(v1, namespace, seeds_reachable), 60*60 ),
-    ( lambda: metrics.pods_with_no_new_logs(v1, namespace, pods_with_no_new_logs), 60*10 ),
-  ]
+  collector_duration = namespaces.metric(Histogram, 'Coda_watchdog_collector_duration_seconds', 'Time taken by each run of a collector', ['namespace', 'collector'], buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+  collector_overruns = namespaces.metric(Histogram, 'Coda_watchdog_collector_overrun_seconds', 'How long past their deadline collector runs that overran took to finish', ['namespace', 'collector'], buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+  collector_skipped_runs = namespaces.metric(Counter, 'Coda_watchdog_collector_skipped_runs', 'Number of collector runs skipped because the previous run had not finished', ['namespace', 'collector'])
+
+  # ========================================================================
+
+  # the collectors for one namespace, each with its own pod inventory and state but reporting to the shared metrics under the namespace's label
+  def namespace_collectors(namespace):
+    m = lambda metric: namespaces.Namespaced(metric, namespace)
+
+    pod_restarts = restart_tracker.RestartTracker(m(container_restarts))
+
+    # shared by all the collectors, so the api server sees one pod watch instead of a list call per collector run
+    inventory = pod_inventory.PodInventory(v1, namespace)
+    inventory.add_listener(pod_restarts.observe)
+    inventory.start()
+
+    # kept between node status collections so the block tree is updated rather than rebuilt
+    block_tree = fork_tree.ForkTree()
+
+    # keeps the chain id and each seed's recent dial results between runs
+    seed_prober = seed_probe.SeedProber()
+
+    # (name, fn, seconds between runs, deadline in seconds)
+    fns = [
+      ( 'cluster_crashes', lambda: metrics.collect_cluster_crashes(v1, namespace, inventory, pod_restarts, m(cluster_crashes)), 30*60, 10*60 ),
+      ( 'restart_analytics', lambda: metrics.collect_restart_analytics(pod_restarts, m(restarts_per_hour), m(mean_time_between_failures), m(crash_looping_containers)), 60, 60 ),
+      ( 'node_status', lambda: metrics.collect_node_status_metrics(v1, namespace, inventory, block_tree, m(nodes_synced_near_best_tip), m(nodes_synced), m(nodes_queried), m(nodes_responded), m(seed_nodes_queried), m(seed_nodes_responded), m(nodes_errored), m(context_deadline_exceeded), m(failed_security_protocol_negotiation), m(connection_refused_errors), m(size_limit_exceeded_errors), m(timed_out_errors), m(stream_reset_errors), m(other_connection_errors), m(prover_errors), m(node_status_errors_by_category), m(nodes_by_blocks_behind), m(network_partitions), m(network_isolated_nodes), m(network_largest_component_fraction), m(network_diameter_estimate), m(network_articulation_points), m(network_peer_degree)), 10*60, 10*60 ),
+      ( 'pods_with_no_new_logs', lambda: metrics.pods_with_no_new_logs(v1, namespace, inventory, m(pods_with_no_new_logs), m(pod_last_log_age)), 60*10, 5*60 ),
+    ]
+
+    seed_peers_url = namespaces.seed_peers_url(namespace, watched)
+    if seed_peers_url is not None:
+      fns += [ ( 'seed_list_up', lambda: metrics.check_seed_list_up(v1, namespace, inventory, seed_peers_url, seed_prober, m(seeds_reachable), m(seed_availability), m(seed_dial_latency)), 60*60, 10*60 ) ]
+    else:
+      print('no seed list for namespace {} (set SEED_PEERS_URLS), not checking its seeds'.format(namespace))
+
+    if os.environ.get('CHECK_GCLOUD_STORAGE_BUCKET') is not None:
+      bucket_watcher = block_bucket.BlockBucketWatcher('mina_network_block_data', namespace)
+      fns += [ ( 'google_storage_bucket', lambda: metrics.check_google_storage_bucket(v1, namespace, bucket_watcher, m(recent_google_bucket_blocks), m(google_bucket_upload_rate), m(google_bucket_max_upload_gap)), 30*60, 10*60 ) ]
+
+    return fns
+
+  collectors = { namespace: namespace_collectors(namespace) for namespace in watched }
+  collector_count = sum(len(fns) for fns in collectors.values())
 
-  if os.environ.get('CHECK_GCLOUD_STORAGE_BUCKET') is not None:
-    fns += [ ( lambda: metrics.check_google_storage_bucket(v1, namespace, recent_google_bucket_blocks), 30*60 ) ]
+  # one thread per collector by default (up to 32), so a slow collector never holds up the others. the threads are shared by every namespace,
+  # and each namespace gets at most its fair share of them when they're all busy
+  collector_threads = int(os.environ.get('COLLECTOR_THREADS', min(collector_count, 32)))
+  scheduler = namespaces.FairScheduler(collector_threads, max_per_namespace=math.ceil(collector_threads / len(watched)))
 
-  for fn, time_between in fns:
-    asyncio.ensure_future(util.run_periodically(fn, time_between, error_counter))
+  for namespace, fns in collectors.items():
+    m = lambda metric: namespaces.Namespaced(metric, namespace)
+    executor = scheduler.executor(namespace)
+    for name, fn, time_between, deadline in fns:
+      asyncio.ensure_future(util.run_periodically(name, fn, time_between, deadline, executor, m(error_counter), m(collector_duration), m(collector_overruns), m(collector_skipped_runs), namespace=namespace))
 
   loop = asyncio.get_event_loop()
   loop.run_forever()
 
-main()
+# the node status parse workers are forkserver processes, which import this module as __mp_main__ and must not start another watchdog
+if __name__ == "__main__":
+  main()
@@ -1,21 +1,53 @@
 #!/usr/bin/env python3
 
 # script to gather and store all node status data from peers reachable from the local daemon
+#
+# the network is crawled breadth first: the peers in each node status response that haven't been seen yet are queued, and the queue is queried
+# in batches of peers per node-status RPC, several batches at a time. peers that don't answer are retried (in later batches) until their attempts
+# run out. each node status is written as a line of JSON as soon as it arrives, once per peer id
+#
+# with --checkpoint, the crawl state (the queue, the peers seen and the attempts made) is saved as the crawl goes. if the crawl is interrupted, running
+# it again with the same --checkpoint and --output resumes it, appending to the output. once a crawl has finished, --warm-start queues every peer
+# it saw up front, instead of rediscovering them one hop at a time
 
 import subprocess
 import sys
 import os
+import time
 import argparse
 import json
+import collections
+import concurrent.futures
 
 default_port=8301
 default_prog='mina'
+default_batch_size=32
+default_concurrency=4
+default_max_attempts=3
+default_timeout_seconds=600
+default_checkpoint_seconds=30
 
 parser = argparse.ArgumentParser(description='Get node status from all Mina nodes reachable from localhost daemon')
 parser.add_argument('--daemon-port',
                     help='daemon port on localhost (default: ' + str(default_port) + ')')
 parser.add_argument('--executable',
                     help='Mina program on localhost (default: ' + str(default_prog) + ')')
+parser.add_argument('--batch-size', type=int, default=default_batch_size,
+                    help='peers queried per node-status call (default: ' + str(default_batch_size) + ')')
+parser.add_argument('--concurrency', type=int, default=default_concurrency,
+                    help='node-status calls in flight at once (default: ' + str(default_concurrency) + ')')
+parser.add_argument('--max-attempts', type=int, default=default_max_attempts,
+                    help='times a peer is queried before giving up on it (default: ' + str(default_max_attempts) + ')')
+parser.add_argument('--timeout-seconds', type=int, default=default_timeout_seconds,
+                    help='timeout for each node-status call (default: ' + str(default_timeout_seconds) + ')')
+parser.add_argument('--output',
+                    help='file to write the node statuses to, one JSON object per line (default: stdout)')
+parser.add_argument('--checkpoint',
+                    help='file to save the crawl state to, to resume an interrupted crawl or warm start the next one')
+parser.add_argument('--checkpoint-seconds', type=int, default=default_checkpoint_seconds,
+                    help='how often the crawl state is saved (default: ' + str(default_checkpoint_seconds) + ')')
+parser.add_argument('--warm-start', action='store_true',
+                    help='start by querying every peer seen by the finished crawl in the checkpoint')
 
 args = parser.parse_args()
 
@@ -29,48 +61,8 @@ if args.executable is None :
 else :
     prog = args.executable
 
-# map from peer IDs to node status
-node_statuses = dict ()
-
-# the peer ids we've already queried
-seen_peer_ids = set ()
-
-def add_node_statuses (output) :
-
-    lines = output.decode ('utf-8').split ('\n')
-
-    # set of peers to query on next round
-    peers_to_query = {}
-
-    # populate map from responses
-    for line in lines :
-        if line == '' :
-            continue
-
-        status = json.loads (line)
-
-        try :
-            node_statuses[status['node_peer_id']] = status
-
-            for peer in status['peers'] :
-                peer_id = peer['peer_id']
-                peers_to_query[peer_id] = peer
-                # don't consider this peer_id again
-                # the query to this peer may not succeed, though
-                seen_peer_ids.add (peer_id)
-
-        except :
-
-            print ('Error in node status response: ' + line)
-
-    return peers_to_query.items()
-
-# get node status from peers known to daemon
-output = subprocess.check_output([prog, 'advanced', 'node-status', '-daemon-peers', '-daemon-port', daemon_port])
-
-peers_to_query = add_node_statuses (output)
-
-done = False
+def log (msg) :
+    print (msg, file=sys.stderr, flush=True)
 
 def peer_to_multiaddr(peer):
     return '/ip4/{}/tcp/{}/p2p/{}'.format(
@@ -78,45 +70,187 @@ def peer_to_multiaddr(peer):
         peer['libp2p_port'],
         peer['peer_id'] )
 
-# calculate fixpoint: add node statuses from peer ids until we see no new peer ids
-while not done :
-
-    done = True
-
-    formatted_peers = ''
-
-    for (peer_id, peer) in peers_to_query :
-        peer = peer_to_multiaddr(peer)
-
-        if peer_id in seen_peer_ids :
-            continue
-        else :
-            done = False
-            if peer_id_count == 0 :
-                formatted_peers = peer
+def node_status (node_status_args) :
+    return subprocess.run ([prog, 'advanced', 'node-status', '-daemon-port', daemon_port] + node_status_args,
+                           stdout=subprocess.PIPE, check=True, timeout=args.timeout_seconds).stdout.decode ('utf-8').split ('\n')
+
+# writes to a temporary file next to path and renames it over path, so an interrupted write leaves the previous checkpoint in place
+def write_json_atomically (path, obj) :
+    tmp_path = path + '.tmp'
+    with open (tmp_path, 'w') as f :
+        json.dump (obj, f)
+        f.flush ()
+        os.fsync (f.fileno ())
+    os.replace (tmp_path, path)
+
+def load_checkpoint () :
+    if args.checkpoint is None or not os.path.exists (args.checkpoint) :
+        return None
+    with open (args.checkpoint, 'r') as f :
+        return json.load (f)
+
+class Crawler :
+
+    def __init__ (self, out) :
+        self.out = out
+        # peer id -> peer, for the peers waiting to be queried
+        self.frontier = collections.OrderedDict ()
+        # the peer ids that have been queued at some point, so each peer enters the frontier once
+        self.seen_peer_ids = set ()
+        # peer id -> peer, for every peer that has been queued
+        self.known_peers = {}
+        # future -> batch, for the node-status calls in flight
+        self.in_flight = {}
+        self.last_checkpoint = time.time ()
+        # the peer ids whose node status has been written
+        self.written_peer_ids = set ()
+        self.attempts = collections.Counter ()
+        self.gave_up = 0
+        self.error_responses = 0
+
+    # writes the new node statuses in lines and queues the peers they know of, returns the peer ids that responded
+    def add_node_statuses (self, lines, write=True) :
+        responded = set ()
+
+        for line in lines :
+            if line == '' :
+                continue
+
+            try :
+                status = json.loads (line)
+                peer_id = status['node_peer_id']
+                peers = status['peers']
+            except (ValueError, KeyError, TypeError) :
+                self.error_responses += 1
+                log ('Error in node status response: ' + line[:500])
+                continue
+
+            responded.add (peer_id)
+            self.seen_peer_ids.add (peer_id)
+            self.frontier.pop (peer_id, None)
+
+            if peer_id not in self.written_peer_ids :
+                self.written_peer_ids.add (peer_id)
+                if write :
+                    self.out.write (json.dumps (status) + '\n')
+                    self.out.flush ()
+
+            for peer in peers :
+                self.queue (peer)
+
+        return responded
+
+    def queue (self, peer) :
+        if peer['peer_id'] not in self.seen_peer_ids :
+            self.seen_peer_ids.add (peer['peer_id'])
+            self.known_peers[peer['peer_id']] = peer
+            self.frontier[peer['peer_id']] = peer
+
+    def save_checkpoint (self, complete) :
+        if args.checkpoint is None :
+            return
+        # the peers of the calls in flight haven't answered yet, a resumed crawl queries them again
+        in_flight = [ peer for batch in self.in_flight.values () for (_, peer) in batch ]
+        write_json_atomically (args.checkpoint, { 'complete': complete,
+                                                  'frontier': in_flight + list (self.frontier.values ()),
+                                                  'seen_peer_ids': list (self.seen_peer_ids),
+                                                  'known_peers': self.known_peers,
+                                                  'attempts': self.attempts,
+                                                  'gave_up': self.gave_up,
+                                                  'error_responses': self.error_responses })
+        self.last_checkpoint = time.time ()
+
+    # picks up an interrupted crawl: the node statuses already in the output are read back in, for the peers they know of that were queued since
+    # the checkpoint was saved
+    def resume (self, checkpoint, output_lines) :
+        self.seen_peer_ids = set (checkpoint['seen_peer_ids'])
+        self.known_peers = checkpoint['known_peers']
+        self.attempts = collections.Counter (checkpoint['attempts'])
+        self.gave_up = checkpoint['gave_up']
+        self.error_responses = checkpoint['error_responses']
+        for peer in checkpoint['frontier'] :
+            self.frontier[peer['peer_id']] = peer
+        self.add_node_statuses (output_lines, write=False)
+        log ('resuming crawl: {} node statuses already written, {} peers queued'.format (len (self.written_peer_ids), len (self.frontier)))
+
+    # queues every peer a previous crawl saw
+    def warm_start (self, checkpoint) :
+        for peer in checkpoint['known_peers'].values () :
+            self.queue (peer)
+        log ('warm start: {} peers from the previous crawl queued'.format (len (self.frontier)))
+
+    def next_batch (self) :
+        batch = []
+        while len (self.frontier) > 0 and len (batch) < args.batch_size :
+            batch.append (self.frontier.popitem (last=False))
+        for (peer_id, _) in batch :
+            self.attempts[peer_id] += 1
+        return batch
+
+    # peers in the batch that didn't respond go to the back of the frontier, until they are out of attempts
+    def requeue (self, batch, responded) :
+        for (peer_id, peer) in batch :
+            if peer_id in responded or peer_id in self.written_peer_ids :
+                continue
+            if self.attempts[peer_id] < args.max_attempts :
+                self.frontier[peer_id] = peer
             else :
-                formatted_peers = peer + ',' + formatted_peers
-
-    if done :
-        break
-
-    output = subprocess.check_output([prog, 'advanced', 'node-status', '-peers', formatted_peers, '-daemon-port', daemon_port])
-    peers_to_query = add_node_statuses (output)
-
-
-
-print ('{ "peer_ids_queried": ' + str(len(seen_peer_ids)) + ',')
-print ('  "node_statuses": [')
-
-num_node_statuses=len(node_statuses)
-count = 0
-
-for status in node_statuses.values () :
-    s = str(status).replace("'",'"')
-    if count < num_node_statuses - 1:
-        print ('  ' + s + ',')
-    else :
-        print ('  ' + s)
-    count += 1
-
-print ('  ]}')
+                self.gave_up += 1
+
+    def crawl (self, resumed=False) :
+        if not resumed :
+            # start from the peers known to the daemon
+            self.add_node_statuses (node_status (['-daemon-peers']))
+
+        with concurrent.futures.ThreadPoolExecutor (max_workers=args.concurrency) as executor :
+            in_flight = self.in_flight
+            while len (self.frontier) > 0 or len (in_flight) > 0 :
+                while len (self.frontier) > 0 and len (in_flight) < args.concurrency :
+                    batch = self.next_batch ()
+                    multiaddrs = ','.join (peer_to_multiaddr (peer) for (_, peer) in batch)
+                    in_flight[executor.submit (node_status, ['-peers', multiaddrs])] = batch
+
+                done, _ = concurrent.futures.wait (in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done :
+                    batch = in_flight.pop (future)
+                    try :
+                        responded = self.add_node_statuses (future.result ())
+                    except (subprocess.SubprocessError, OSError) as e :
+                        log ('node-status call for ' + str (len (batch)) + ' peers failed: ' + str (e))
+                        responded = set ()
+                    self.requeue (batch, responded)
+
+                log ('{} node statuses, {} peers queued, {} batches in flight'.format (
+                    len (self.written_peer_ids), len (self.frontier), len (in_flight)))
+
+                if time.time () - self.last_checkpoint >= args.checkpoint_seconds :
+                    self.save_checkpoint (complete=False)
+
+        self.save_checkpoint (complete=True)
+
+        log (json.dumps ({ 'peer_ids_seen': len (self.seen_peer_ids),
+                           'node_statuses': len (self.written_peer_ids),
+                           'peers_given_up_on': self.gave_up,
+                           'error_responses': self.error_responses }))
+
+checkpoint = load_checkpoint ()
+
+if checkpoint is not None and not checkpoint['complete'] and args.output is not None and os.path.exists (args.output) :
+    # the last line may have been cut short by the interruption, it's dropped (and the peer queried again) rather than appended to
+    with open (args.output, 'rb+') as out :
+        lines = out.read ().split (b'\n')
+        out.truncate (sum (len (line) + 1 for line in lines[:-1]))
+    with open (args.output, 'a') as out :
+        crawler = Crawler (out)
+        crawler.resume (checkpoint, [ line.decode ('utf-8') for line in lines[:-1] ])
+        crawler.crawl (resumed=True)
+else :
+    if checkpoint is not None and not checkpoint['complete'] :
+        log ('the checkpoint is of an unfinished crawl, but there is no --output to resume it from, starting over')
+
+    out = sys.stdout if args.output is None else open (args.output, 'w')
+    crawler = Crawler (out)
+    if args.warm_start and checkpoint is not None :
+        crawler.warm_start (checkpoint)
+    crawler.crawl ()
+    out.close ()